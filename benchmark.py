@@ -1,18 +1,52 @@
 from sign import *
 from timeit import timeit
 
-for mode in [2, 3, 5]:
-    g.set_mode(mode)
-    print(f"Dilithium{mode}")
+ITERATIONS = 500
 
-    t = timeit("crypto_sign_keypair(pk, sk)", setup="pk, sk= [0]*g.CRYPTO_PUBLICKEYBYTES, [0]*g.CRYPTO_SECRETKEYBYTES", globals=globals(), number=500)
-    print(f"key generation: {round(t, 3)}s")
+def bench_ntt():
+    a = [x*x % g.Q for x in range(g.N)]
+    for arith in ["montgomery", "plain"]:
+        g.ARITH = arith
+        for engine in ["reference", "radix4"]:
+            g.NTT_ENGINE = engine
+            t = timeit("ntt_batch([a.copy()])", globals={**globals(), "a": a}, number=100*ITERATIONS)
+            print(f"ntt ({engine}, {arith}): {round(t, 3)}s")
+            t = timeit("invntt_tomont_batch([a.copy()])", globals={**globals(), "a": a}, number=100*ITERATIONS)
+            print(f"invntt ({engine}, {arith}): {round(t, 3)}s")
+    g.NTT_ENGINE = "reference"
+    g.ARITH = "montgomery"
+    print()
 
-    stp = """pk, sk= [0]*g.CRYPTO_PUBLICKEYBYTES, [0]*g.CRYPTO_SECRETKEYBYTES;crypto_sign_keypair(pk, sk);sig = [0]*g.CRYPTO_BYTES;m = list(urandom(32))"""
-    t = timeit("crypto_sign_signature(sig, None, m, None, sk)", setup = stp, globals=globals(), number=500)
-    print(f"signing 32 byte msg: {round(t, 3)}s")
 
-    stp  = """pk, sk= [0]*g.CRYPTO_PUBLICKEYBYTES, [0]*g.CRYPTO_SECRETKEYBYTES;crypto_sign_keypair(pk, sk);sig = [0]*g.CRYPTO_BYTES;m = list(urandom(32));crypto_sign_signature(sig, None, m, None, sk)
-    """
-    t = timeit("crypto_sign_verify(sig, None, m, None, pk)", setup=stp, globals=globals(), number=500)
-    print(f"verifying 32 byte msg: {round(t, 3)}s\n")
+def bench(title):
+    for mode in [2, 3, 5]:
+        g.set_mode(mode)
+        print(f"Dilithium{mode} ({title})")
+
+        t = timeit("crypto_sign_keypair(pk, sk)", setup="pk, sk= [0]*g.CRYPTO_PUBLICKEYBYTES, [0]*g.CRYPTO_SECRETKEYBYTES", globals=globals(), number=ITERATIONS)
+        print(f"key generation: {round(t, 3)}s")
+
+        stp = """pk, sk= [0]*g.CRYPTO_PUBLICKEYBYTES, [0]*g.CRYPTO_SECRETKEYBYTES;crypto_sign_keypair(pk, sk);sig = [0]*g.CRYPTO_BYTES;m = list(urandom(32))"""
+        t = timeit("crypto_sign_signature(sig, None, m, None, sk)", setup = stp, globals=globals(), number=ITERATIONS)
+        print(f"signing 32 byte msg: {round(t, 3)}s")
+
+        stp  = """pk, sk= [0]*g.CRYPTO_PUBLICKEYBYTES, [0]*g.CRYPTO_SECRETKEYBYTES;crypto_sign_keypair(pk, sk);sig = [0]*g.CRYPTO_BYTES;m = list(urandom(32));crypto_sign_signature(sig, None, m, None, sk)
+        """
+        t = timeit("crypto_sign_verify(sig, None, m, None, pk)", setup=stp, globals=globals(), number=ITERATIONS)
+        print(f"verifying 32 byte msg: {round(t, 3)}s\n")
+
+
+print(f"{100*ITERATIONS} NTTs of one polynomial")
+bench_ntt()
+
+bench("montgomery arithmetic")
+
+g.ARITH = "plain"
+bench("plain arithmetic")
+g.ARITH = "montgomery"
+
+g.POLYMUL = "kronecker"
+bench("kronecker multiplication")
+g.POLYMUL = "fft"
+bench("fft multiplication")
+g.POLYMUL = "ntt"
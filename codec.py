@@ -0,0 +1,274 @@
+# Generic bit-packing codec for the keys and signatures. Every packed
+# polynomial in Dilithium stores its coefficients one after the other, least
+# significant bit first, with a fixed bit width per coefficient. A
+# field is therefore described by a (bits, offset) spec: the stored value is
+# offset - c, or c itself if the offset is None.
+
+from params import *
+from storage import *
+from math import gcd
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+#################################################
+# Name:        codec_spec
+#
+# Description: (bits, offset) spec of a kind of packed polynomial for the
+#              current mode.
+#
+# Arguments:   - str kind: "eta", "t1", "t0", "z" or "w1"
+#
+# Returns tuple (bits, offset).
+##################################################
+def codec_spec(kind: str) -> tuple[int, int]:
+    if kind == "eta":
+        return (3 if g.ETA == 2 else 4), g.ETA
+    if kind == "t1":
+        return 10, None
+    if kind == "t0":
+        return g.D, 1 << (g.D-1)
+    if kind == "z":
+        return (18 if g.GAMMA1 == (1 << 17) else 20), g.GAMMA1
+    if kind == "w1":
+        return (6 if g.GAMMA2 == (g.Q-1)//88 else 4), None
+    raise ValueError("Unknown field kind " + kind)
+
+
+#################################################
+# Name:        pack_array
+#
+# Description: Bit-pack rows of coefficients with one vectorized pass.
+#
+# Arguments:   - np.ndarray a: int64 array of shape (n, N)
+#              - int bits: bit width of one coefficient
+#              - int offset: stored value is offset - c, None to store c
+#
+# Returns bytes of length n*N*bits/8.
+##################################################
+def pack_array(a, bits: int, offset: int) -> bytes:
+    if np is None:
+        raise ImportError("The numpy codec requires numpy")
+    if offset is not None:
+        a = offset - a
+    b = (a[..., None] >> np.arange(bits)) & 1
+    return np.packbits(b.astype(np.uint8).ravel(), bitorder='little').tobytes()
+
+
+#################################################
+# Name:        unpack_array
+#
+# Description: Inverse of pack_array.
+#
+# Arguments:   - bytes a: packed coefficients
+#              - int bits: bit width of one coefficient
+#              - int offset: stored value is offset - c, None if c is stored
+#
+# Returns int64 array of shape (n, N).
+##################################################
+def unpack_array(a: bytes, bits: int, offset: int):
+    if np is None:
+        raise ImportError("The numpy codec requires numpy")
+    b = np.frombuffer(bytes(a), dtype=np.uint8)
+    per = 8//gcd(bits, 8)
+    if bits <= 24 and len(b)*8 >= 64*per*per*bits:
+        r = _unpack_groups(b, bits, per)
+    else:
+        b = np.unpackbits(b, bitorder='little')
+        r = b.reshape(-1, bits).astype(np.int64) @ (1 << np.arange(bits, dtype=np.int64))
+    if offset is not None:
+        r = offset - r
+    return r.reshape(-1, g.N)
+
+
+# The coefficients repeat their byte alignment every per = 8/gcd(bits, 8) of
+# them, so each position in such a group is read from the at most four bytes
+# that hold it with one shift and mask over all groups. That costs a few array
+# operations per position, so unpack_array() only takes it once there are at
+# least 64 groups per position; below that bit unpacking is faster.
+def _unpack_groups(b, bits: int, per: int):
+    b = b.reshape(-1, bits*per//8).astype(np.int64)
+    r = np.empty((len(b), per), dtype=np.int64)
+    for j in range(per):
+        k, s = divmod(j*bits, 8)
+        x = b[:, k]
+        for i in range(1, (s + bits + 7)//8):
+            x = x | (b[:, k+i] << 8*i)
+        r[:, j] = (x >> s) & ((1 << bits) - 1)
+    return r
+
+
+# Pure Python versions. A polynomial is packed into one integer, which turns
+# the bit shuffling into integer shifts done by the interpreter in C.
+def _pack_poly(c: List[int], bits: int, offset: int) -> bytes:
+    mask = (1 << bits) - 1
+    if offset is not None:
+        c = [offset - x for x in c]
+    x = 0
+    for v in reversed(c):
+        x = (x << bits) | (v & mask)
+    return x.to_bytes(g.N*bits//8, 'little')
+
+
+def _unpack_poly(a: bytes, bits: int, offset: int) -> List[int]:
+    mask = (1 << bits) - 1
+    x = int.from_bytes(bytes(a), 'little')
+    c = [(x >> i) & mask for i in range(0, g.N*bits, bits)]
+    if offset is not None:
+        c = [offset - v for v in c]
+    return c
+
+
+#################################################
+# Name:        pack_polys
+#
+# Description: Bit-pack several polynomials into a contiguous buffer.
+#
+# Arguments:   - List[int] buf: output byte array
+#              - int start: position of the first packed byte in buf
+#              - List[poly] polys: input polynomials
+#              - str kind: kind of the polynomials, see codec_spec
+#
+# Returns position after the last packed byte.
+##################################################
+def pack_polys(buf: List[int], start: int, polys, kind: str) -> int:
+    bits, offset = codec_spec(kind)
+    if g.KERNELS == "numpy":
+        r = pack_array(np.array([p.coeffs for p in polys], dtype=np.int64), bits, offset)
+    else:
+        r = b"".join(_pack_poly(p.coeffs, bits, offset) for p in polys)
+    buf[start:start+len(r)] = r
+    return start + len(r)
+
+
+#################################################
+# Name:        unpack_polys
+#
+# Description: Unpack several polynomials from a contiguous buffer.
+#
+# Arguments:   - List[poly] polys: output polynomials
+#              - List[int] buf: byte array with the packed polynomials
+#              - int start: position of the first packed byte in buf
+#              - str kind: kind of the polynomials, see codec_spec
+#
+# Returns position after the last unpacked byte.
+##################################################
+def unpack_polys(polys, buf: List[int], start: int, kind: str) -> int:
+    bits, offset = codec_spec(kind)
+    size = g.N*bits//8
+    end = start + len(polys)*size
+    if g.KERNELS == "numpy":
+        for p, r in zip(polys, unpack_array(buf[start:end], bits, offset)):
+            set_coeffs(p.coeffs, r)
+    else:
+        for i, p in enumerate(polys):
+            set_coeffs(p.coeffs, _unpack_poly(buf[start+i*size:start+(i+1)*size], bits, offset))
+    return end
+
+
+#################################################
+# Name:        pack_hint
+#
+# Description: Encode the hint vector as the indices of its nonzero
+#              coefficients followed by the running count per polynomial.
+#
+# Arguments:   - List[int] buf: output byte array
+#              - int start: position of the encoding in buf
+#              - List[poly] polys: hint polynomials
+#
+# Returns position after the encoding.
+##################################################
+def pack_hint(buf: List[int], start: int, polys) -> int:
+    idx = []
+    for i, p in enumerate(polys):
+        idx += [j for j, c in enumerate(p.coeffs) if c != 0]
+        buf[start+g.OMEGA+i] = len(idx)
+    buf[start:start+g.OMEGA] = idx + [0]*(g.OMEGA - len(idx))
+    return start + g.OMEGA + len(polys)
+
+
+#################################################
+# Name:        unpack_hint
+#
+# Description: Decode the hint vector. The encoding is rejected unless the
+#              indices of every polynomial are strictly increasing and the
+#              unused slots are zero, so it is unique.
+#
+# Arguments:   - List[poly] polys: output hint polynomials
+#              - List[int] buf: byte array with the encoding
+#              - int start: position of the encoding in buf
+#
+# Returns 1 in case of malformed encoding; otherwise 0.
+##################################################
+def unpack_hint(polys, buf: List[int], start: int) -> int:
+    k = 0
+    for i, p in enumerate(polys):
+        c = [0]*g.N
+        n = buf[start+g.OMEGA+i]
+        if n < k or n > g.OMEGA:
+            return 1
+        idx = buf[start+k:start+n]
+        for j in range(1, len(idx)):
+            if idx[j] <= idx[j-1]:
+                return 1
+        for j in idx:
+            c[j] = 1
+        set_coeffs(p.coeffs, c)
+        k = n
+
+    if any(buf[start+k:start+g.OMEGA]):
+        return 1
+    return 0
+
+
+#################################################
+# Name:        pack_fields
+#
+# Description: Pack a layout of fields into a contiguous buffer. A field is a
+#              pair (kind, value): kind "bytes" copies a byte array, "hint"
+#              encodes a hint vector and the other kinds bit-pack a list of
+#              polynomials, see codec_spec.
+#
+# Arguments:   - List[int] buf: output byte array
+#              - fields: list of (kind, value) pairs
+##################################################
+def pack_fields(buf: List[int], fields):
+    start = 0
+    for kind, v in fields:
+        if kind == "bytes":
+            buf[start:start+len(v)] = v
+            start += len(v)
+        elif kind == "hint":
+            start = pack_hint(buf, start, v)
+        else:
+            start = pack_polys(buf, start, v, kind)
+
+
+#################################################
+# Name:        unpack_fields
+#
+# Description: Unpack a layout of fields from a contiguous buffer, see
+#              pack_fields. The values are filled in place; byte arrays have
+#              to be allocated with the length of the field.
+#
+# Arguments:   - List[int] buf: byte array with the packed fields
+#              - fields: list of (kind, value) pairs
+#
+# Returns 1 in case of a malformed hint encoding; otherwise 0.
+##################################################
+def unpack_fields(buf: List[int], fields) -> int:
+    start = 0
+    for kind, v in fields:
+        if kind == "bytes":
+            v[:] = buf[start:start+len(v)]
+            start += len(v)
+        elif kind == "hint":
+            if unpack_hint(v, buf, start):
+                return 1
+            start += g.OMEGA + len(v)
+        else:
+            start = unpack_polys(v, buf, start, kind)
+    return 0
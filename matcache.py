@@ -0,0 +1,218 @@
+# Cache of expanded matrices A shared between processes. Matrices live in
+# multiprocessing.shared_memory blocks, so a matrix expanded by one worker is
+# reused by all others. A directory block holds one slot per cached matrix
+# with its key, size and time of last use for LRU eviction under a byte
+# budget. Lookups take no lock: they find the slot, attach the block, check
+# its ready flag and copy the matrix out. Insertion and eviction are
+# serialized by a multiprocessing.Lock, which reaches the workers by fork or
+# by passing the cache to them when they are started (e.g. as initargs of a
+# multiprocessing.Pool).
+
+from polyvec import *
+from multiprocessing import resource_tracker, shared_memory
+import multiprocessing
+from array import array
+import hashlib
+import struct
+import sys
+import time
+
+# Directory slot: key, size of the block in bytes (0 for a free slot), time of
+# last use
+MATCACHE_SLOT = struct.Struct("<16sqd")
+# Header of a matrix block: ready flag, key. The coefficients follow as int64.
+MATCACHE_HEADER = struct.Struct("<q16s")
+
+
+# The blocks belong to the cache and not to the process that created or
+# attached them, so keep the resource tracker from unlinking them when that
+# process exits.
+def _shm(name: str = None, create: bool = False, size: int = 0):
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, create, size, track=False)
+    shm = shared_memory.SharedMemory(name, create, size)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+# SharedMemory.unlink() unregisters the block again before Python 3.13
+def _shm_unlink(shm):
+    if sys.version_info < (3, 13):
+        resource_tracker.register(shm._name, "shared_memory")
+    shm.unlink()
+
+
+def _matrix_to_bytes(mat) -> bytes:
+    if isinstance(mat, list):
+        return b"".join(array('q', p.coeffs).tobytes() for v in mat for p in v.vec)
+    return np.ascontiguousarray(mat, dtype=np.int64).tobytes()
+
+
+def _matrix_from_bytes(raw: bytes):
+    mat = polyvec_matrix_new()
+    if not isinstance(mat, list):
+        return np.frombuffer(raw, dtype=np.int64).reshape(mat.shape)
+    a = array('q')
+    a.frombytes(raw)
+    for i in range(g.K):
+        for j in range(g.L):
+            o = (i*g.L + j)*g.N
+            set_coeffs(mat[i].vec[j].coeffs, a[o:o+g.N])
+    return mat
+
+
+#################################################
+# Name:        MatrixCache
+#
+# Description: Shared memory cache of expanded matrices indexed by rho and
+#              the mode. matrix() returns A in the form polyvec_matrix_new()
+#              gives; a tensor is a read-only view of a private copy. The
+#              counters hits, misses and evictions count the operations of
+#              the current process.
+#
+# Arguments:   - int budget: bytes of shared memory the matrices may use
+#              - int slots: maximal number of cached matrices
+#              - str name: name of the directory block, None for a random one
+#              - context: multiprocessing context of the workers, for the lock
+##################################################
+class MatrixCache:
+    def __init__(self, budget: int = 64 << 20, slots: int = 64, name: str = None, context=None):
+        if slots < 1:
+            raise ValueError("The cache needs at least one slot")
+        self.budget, self.slots = budget, slots
+        self.lock = (context or multiprocessing).Lock()
+        self.directory = _shm(name, True, slots*MATCACHE_SLOT.size)
+        self.name = self.directory.name
+        self.hits = self.misses = self.evictions = 0
+
+    def __getstate__(self):
+        return self.name, self.budget, self.slots, self.lock
+
+    def __setstate__(self, state):
+        self.name, self.budget, self.slots, self.lock = state
+        self.directory = _shm(self.name)
+        self.hits = self.misses = self.evictions = 0
+
+    # Everything that changes the content of A goes into the key
+    def _key(self, rho: List[int]) -> bytes:
+        h = hashlib.sha256(b"%d %d %s " % (g.K, g.L, g.POLYMUL.encode()))
+        h.update(bytes(rho))
+        return h.digest()[:16]
+
+    # POSIX limits shared memory names to 31 characters on some systems
+    def _block(self, key: bytes) -> str:
+        return self.name[:12] + "_" + key[:8].hex()
+
+    def _slots(self) -> list:
+        return [MATCACHE_SLOT.unpack_from(self.directory.buf, i*MATCACHE_SLOT.size) for i in range(self.slots)]
+
+    def _find(self, key: bytes) -> int:
+        for i, (k, size, _) in enumerate(self._slots()):
+            if size and k == key:
+                return i
+        return -1
+
+    def _read(self, key: bytes):
+        i = self._find(key)
+        if i < 0:
+            return None
+        try:
+            shm = _shm(self._block(key))
+        except FileNotFoundError:
+            # Evicted after the directory was read
+            return None
+        try:
+            ready, k = MATCACHE_HEADER.unpack_from(shm.buf)
+            if not ready or k != key:
+                return None
+            raw = bytes(shm.buf[MATCACHE_HEADER.size:MATCACHE_HEADER.size + 8*g.K*g.L*g.N])
+        finally:
+            shm.close()
+        # The slot may have been evicted and reused since it was found, so
+        # only refresh it if it still holds this key. The write is racy, but
+        # a lost update only makes the LRU order slightly stale.
+        k, size, _ = MATCACHE_SLOT.unpack_from(self.directory.buf, i*MATCACHE_SLOT.size)
+        if size and k == key:
+            struct.pack_into("<d", self.directory.buf, i*MATCACHE_SLOT.size + 24, time.time())
+        return _matrix_from_bytes(raw)
+
+    def _unlink(self, key: bytes):
+        try:
+            shm = _shm(self._block(key))
+        except FileNotFoundError:
+            return
+        _shm_unlink(shm)
+        shm.close()
+
+    def _insert(self, key: bytes, mat):
+        raw = _matrix_to_bytes(mat)
+        size = MATCACHE_HEADER.size + len(raw)
+        if size > self.budget:
+            return
+        with self.lock:
+            slots = self._slots()
+            if any(s[1] and s[0] == key for s in slots):
+                return
+            used = sum(s[1] for s in slots)
+            free = [i for i, s in enumerate(slots) if not s[1]]
+            while used + size > self.budget or not free:
+                i = min((i for i, s in enumerate(slots) if s[1]), key=lambda i: slots[i][2])
+                # Clear the slot before the block goes, so readers miss
+                MATCACHE_SLOT.pack_into(self.directory.buf, i*MATCACHE_SLOT.size, b"", 0, 0.0)
+                self._unlink(slots[i][0])
+                used -= slots[i][1]
+                slots[i] = (b"", 0, 0.0)
+                free.append(i)
+                self.evictions += 1
+
+            try:
+                shm = _shm(self._block(key), True, size)
+            except FileExistsError:
+                # Left behind by a writer that died before filling its slot
+                shm = _shm(self._block(key))
+            shm.buf[MATCACHE_HEADER.size:size] = raw
+            MATCACHE_HEADER.pack_into(shm.buf, 0, 1, key)
+            shm.close()
+            MATCACHE_SLOT.pack_into(self.directory.buf, free[0]*MATCACHE_SLOT.size, key, size, time.time())
+
+    #################################################
+    # Name:        matrix
+    #
+    # Description: Expanded matrix A for rho in the current mode, from the
+    #              cache or expanded with polyvec_matrix_expand() and added.
+    #
+    # Arguments:   - List[int] rho: byte array containing seed rho
+    #
+    # Returns the matrix.
+    ##################################################
+    def matrix(self, rho: List[int]):
+        key = self._key(rho)
+        mat = self._read(key)
+        if mat is not None:
+            self.hits += 1
+            return mat
+        self.misses += 1
+        mat = polyvec_matrix_new()
+        polyvec_matrix_expand(mat, rho)
+        self._insert(key, mat)
+        return mat
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def close(self):
+        self.directory.close()
+
+    #################################################
+    # Name:        unlink
+    #
+    # Description: Remove all matrices and the directory from shared memory.
+    #              Call it once, in the process that created the cache, when
+    #              no worker uses it anymore.
+    ##################################################
+    def unlink(self):
+        with self.lock:
+            for k, size, _ in self._slots():
+                if size:
+                    self._unlink(k)
+            _shm_unlink(self.directory)
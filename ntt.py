@@ -2,6 +2,13 @@
 
 from params import *
 from reduce import *
+from storage import *
+from parallel import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 zetas = [
          0,    25847, -2608894,  -518909,   237124,  -777960,  -876248,   466468,
@@ -96,3 +103,460 @@ def invntt_tomont(a: List[int]) -> List[int]:
         a[j] = montgomery_reduce(f*a[j])
 
     return a
+
+
+
+# The same twiddle factors as plain residues zeta^{brv(k)} mod Q, for the
+# "plain" arithmetic where products are reduced with % Q instead of
+# montgomery_reduce.
+zetas_plain = [montgomery_reduce(z) % g.Q for z in zetas]
+
+# 256^{-1} mod Q, and the last inverse layer twiddle premultiplied by it
+INV_N = pow(g.N, -1, g.Q)
+INV_N_ZETA = (-zetas_plain[1]*INV_N) % g.Q
+
+
+##################################################
+# Name:        ntt_plain
+#
+# Description: Forward NTT with plain modular arithmetic, in-place. Output is
+#              congruent to that of ntt(). No modular reduction is performed
+#              after additions or subtractions.
+#
+# Arguments:   - List[int] a: input/output coefficient array
+##################################################
+def ntt_plain(a:List[int]) -> List[int]:
+    Q = g.Q
+    k = 0
+    l = 128
+    while l > 0:
+        start = 0
+        while start < g.N:
+            k += 1
+            zeta = zetas_plain[k]
+            for j in range(start, start+l):
+                t = zeta * a[j+l] % Q
+                a[j+l] = a[j] - t
+                a[j] = a[j] + t
+            start = j + l + 1
+        l >>= 1
+    return a
+
+
+##################################################
+# Name:        invntt_plain
+#
+# Description: Inverse NTT with plain modular arithmetic, in-place. This is
+#              the counterpart of invntt_tomont() without the Montgomery
+#              factor: the scaling by 1/256 is folded into the twiddle of the
+#              last layer. Output coefficients are standard representatives.
+#
+# Arguments:   - List[int] a: input/output coefficient array
+##################################################
+def invntt_plain(a: List[int]) -> List[int]:
+    Q = g.Q
+    k = 256
+    l = 1
+    while l < g.N >> 1:
+        start = 0
+        while start < g.N:
+            k -= 1
+            zeta = Q - zetas_plain[k]
+            for j in range(start, start + l):
+                t = a[j]
+                a[j] = t + a[j+l]
+                a[j+l] = zeta*(t - a[j+l]) % Q
+            start = j + l + 1
+        l <<= 1
+    for j in range(l):
+        t = a[j]
+        a[j] = (t + a[j+l])*INV_N % Q
+        a[j+l] = (t - a[j+l])*INV_N_ZETA % Q
+
+    return a
+
+
+
+# Twiddle tables for the radix-4 NTT. Pairs of butterfly layers are merged,
+# so every entry holds the first coefficient of a block of 4*h coefficients
+# and the three zetas used on it. The inverse tables hold the negated zetas.
+def _radix4_tables(zetas):
+    fwd = []
+    for s in range(0, 8, 2):
+        l = 128 >> s
+        fwd.append((l, tuple((2*l*b, zetas[(1 << s) + b], zetas[(2 << s) + 2*b], zetas[(2 << s) + 2*b + 1])
+                             for b in range(1 << s))))
+    inv = []
+    for s in range(0, 8, 2):
+        l = 1 << s
+        inv.append((l, tuple((4*l*b, -zetas[(256 >> s) - 1 - 2*b], -zetas[(256 >> s) - 2 - 2*b], -zetas[(128 >> s) - 1 - b])
+                             for b in range(64 >> s))))
+    return fwd, inv
+
+NTT_RADIX4, INVNTT_RADIX4 = _radix4_tables(zetas)
+NTT_RADIX4_PLAIN, INVNTT_RADIX4_PLAIN = _radix4_tables(zetas_plain)
+# montgomery_reduce() adds Q back to intermediate results at or below this
+MONT_LO = (g.Q >> 1) - g.Q
+
+
+##################################################
+# Name:        ntt_radix4
+#
+# Description: Forward NTT, in-place, with pairs of layers merged into radix-4
+#              butterflies and montgomery_reduce() inlined. Gives exactly the
+#              same output as ntt(), or as ntt_plain() with plain arithmetic.
+#
+# Arguments:   - List[int] a: input/output coefficient array
+##################################################
+def ntt_radix4(a:List[int]) -> List[int]:
+    Q = g.Q
+    if g.ARITH == "plain":
+        for l, blocks in NTT_RADIX4_PLAIN:
+            h = l >> 1
+            for start, z1, z2, z3 in blocks:
+                for j in range(start, start + h):
+                    j1 = j + h; j2 = j + l; j3 = j2 + h
+                    a0 = a[j]; a1 = a[j1]; a2 = a[j2]; a3 = a[j3]
+                    t = z1*a2 % Q; a2 = a0 - t; a0 += t
+                    t = z1*a3 % Q; a3 = a1 - t; a1 += t
+                    t = z2*a1 % Q; a[j1] = a0 - t; a[j] = a0 + t
+                    t = z3*a3 % Q; a[j3] = a2 - t; a[j2] = a2 + t
+        return a
+
+    lo = MONT_LO
+    for l, blocks in NTT_RADIX4:
+        h = l >> 1
+        for start, z1, z2, z3 in blocks:
+            for j in range(start, start + h):
+                j1 = j + h; j2 = j + l; j3 = j2 + h
+                a0 = a[j]; a1 = a[j1]; a2 = a[j2]; a3 = a[j3]
+
+                t = z1*a2; t = (t - ((t*QINV) & 0xFFFFFFFF)*Q) >> 32
+                if t <= lo: t += Q
+                a2 = a0 - t; a0 += t
+
+                t = z1*a3; t = (t - ((t*QINV) & 0xFFFFFFFF)*Q) >> 32
+                if t <= lo: t += Q
+                a3 = a1 - t; a1 += t
+
+                t = z2*a1; t = (t - ((t*QINV) & 0xFFFFFFFF)*Q) >> 32
+                if t <= lo: t += Q
+                a[j1] = a0 - t; a[j] = a0 + t
+
+                t = z3*a3; t = (t - ((t*QINV) & 0xFFFFFFFF)*Q) >> 32
+                if t <= lo: t += Q
+                a[j3] = a2 - t; a[j2] = a2 + t
+    return a
+
+
+##################################################
+# Name:        invntt_tomont_radix4
+#
+# Description: Inverse NTT and multiplication by Montgomery factor 2^32,
+#              in-place, with pairs of layers merged into radix-4 butterflies
+#              and montgomery_reduce() inlined. Gives exactly the same output
+#              as invntt_tomont(), or as invntt_plain() with plain arithmetic.
+#
+# Arguments:   - List[int] a: input/output coefficient array
+##################################################
+def invntt_tomont_radix4(a: List[int]) -> List[int]:
+    Q = g.Q
+    if g.ARITH == "plain":
+        for l, blocks in INVNTT_RADIX4_PLAIN:
+            for start, za, zb, zc in blocks:
+                for j in range(start, start + l):
+                    j1 = j + l; j2 = j1 + l; j3 = j2 + l
+                    a0 = a[j]; a1 = a[j1]; a2 = a[j2]; a3 = a[j3]
+                    t = a0; a0 = t + a1; a1 = za*(t - a1) % Q
+                    t = a2; a2 = t + a3; a3 = zb*(t - a3) % Q
+                    a[j] = a0 + a2; a[j2] = zc*(a0 - a2) % Q
+                    a[j1] = a1 + a3; a[j3] = zc*(a1 - a3) % Q
+        set_coeffs(a, [x*INV_N % Q for x in a])
+        return a
+
+    f = 41978 # mont^2/256
+    lo = MONT_LO
+    for l, blocks in INVNTT_RADIX4:
+        for start, za, zb, zc in blocks:
+            for j in range(start, start + l):
+                j1 = j + l; j2 = j1 + l; j3 = j2 + l
+                a0 = a[j]; a1 = a[j1]; a2 = a[j2]; a3 = a[j3]
+
+                t = za*(a0 - a1); t = (t - ((t*QINV) & 0xFFFFFFFF)*Q) >> 32
+                if t <= lo: t += Q
+                a0 += a1; a1 = t
+
+                t = zb*(a2 - a3); t = (t - ((t*QINV) & 0xFFFFFFFF)*Q) >> 32
+                if t <= lo: t += Q
+                a2 += a3; a3 = t
+
+                t = zc*(a0 - a2); t = (t - ((t*QINV) & 0xFFFFFFFF)*Q) >> 32
+                if t <= lo: t += Q
+                a[j] = a0 + a2; a[j2] = t
+
+                t = zc*(a1 - a3); t = (t - ((t*QINV) & 0xFFFFFFFF)*Q) >> 32
+                if t <= lo: t += Q
+                a[j1] = a1 + a3; a[j3] = t
+
+    for j in range(g.N):
+        t = f*a[j]; t = (t - ((t*QINV) & 0xFFFFFFFF)*Q) >> 32
+        if t <= lo: t += Q
+        a[j] = t
+
+    return a
+
+# Per-layer twiddle vectors for the array engine. Layer s of the forward NTT
+# uses the 2^s zetas zetas[2^s:2^{s+1}], one per block of 2*l coefficients.
+# The inverse NTT walks the table backwards with negated zetas.
+# Both tables exist for montgomery and for plain arithmetic.
+def _layer_tables(zetas):
+    z = np.array(zetas, dtype=np.int64)
+    fwd = [(z[1 << s:2 << s].reshape(-1, 1), 128 >> s) for s in range(8)]
+    inv = [(-z[(256 >> s) - 1:(128 >> s) - 1:-1].reshape(-1, 1), 1 << s) for s in range(8)]
+    return fwd, inv
+
+if np is not None:
+    _layers = {"montgomery": _layer_tables(zetas), "plain": _layer_tables(zetas_plain)}
+
+
+##################################################
+# Name:        ntt_array
+#
+# Description: Forward NTT of a whole batch of polynomials, in-place. Each
+#              layer is done as one vectorized butterfly over all
+#              polynomials. Gives exactly the same output as ntt(), or as
+#              ntt_plain() with plain arithmetic.
+#
+# Arguments:   - np.ndarray a: contiguous int64 array of shape (n, N)
+##################################################
+def ntt_array(a):
+    n = a.shape[0]
+    for zeta, l in _layers[g.ARITH][0]:
+        v = a.reshape(n, -1, 2, l)
+        if g.ARITH == "plain":
+            t = zeta*v[:, :, 1] % g.Q
+        else:
+            t = montgomery_reduce_array(zeta*v[:, :, 1])
+        v[:, :, 1] = v[:, :, 0] - t
+        v[:, :, 0] += t
+    return a
+
+
+##################################################
+# Name:        invntt_tomont_array
+#
+# Description: Inverse NTT and multiplication by Montgomery factor 2^32 of a
+#              whole batch of polynomials, in-place. Gives exactly the same
+#              output as invntt_tomont(). With plain arithmetic there is no
+#              Montgomery factor and the output is that of invntt_plain().
+#
+# Arguments:   - np.ndarray a: contiguous int64 array of shape (n, N)
+##################################################
+def invntt_tomont_array(a):
+    f = 41978 # mont^2/256
+
+    n = a.shape[0]
+    for zeta, l in _layers[g.ARITH][1]:
+        v = a.reshape(n, -1, 2, l)
+        t = v[:, :, 0] - v[:, :, 1]
+        v[:, :, 0] += v[:, :, 1]
+        if g.ARITH == "plain":
+            v[:, :, 1] = zeta*t % g.Q
+        else:
+            v[:, :, 1] = montgomery_reduce_array(zeta*t)
+    if g.ARITH == "plain":
+        a[:] = a*INV_N % g.Q
+    else:
+        a[:] = montgomery_reduce_array(f*a)
+
+    return a
+
+
+# Transform matrices for the matrix multiplication engine, built on first use.
+# The NTT maps a to a(zeta^{2*brv(i)+1}) in bit-reversed order i. The
+# matrices are stored transposed and split into balanced 12-bit limbs
+# M = M0 + M1*2^12, side by side, so one float64 product a @ [M0 | M1] of
+# centered inputs (|a| <= Q/2) has partial sums below 2^{22+11+8} and is exact.
+_matmul_tables = {}
+
+def _matmul_table(kind):
+    if kind not in _matmul_tables:
+        brv = [int(f"{i:08b}"[::-1], 2) for i in range(g.N)]
+        roots = [pow(g.ROOT_OF_UNITY, 2*brv[i] + 1, g.Q) for i in range(g.N)]
+        if kind != "ntt":
+            roots = [pow(r, -1, g.Q) for r in roots]
+        # m[i, j] = roots[i]^j
+        m = np.ones((g.N, g.N), dtype=np.int64)
+        for j in range(1, g.N):
+            m[:, j] = m[:, j-1]*roots % g.Q
+        if kind == "ntt":
+            m = m.T
+        else:
+            m = m*(INV_N*(MONT if kind == "montgomery" else 1) % g.Q) % g.Q
+        m -= (m > (g.Q >> 1))*g.Q
+        m0 = ((m + 2048) & 4095) - 2048
+        _matmul_tables[kind] = np.hstack([m0, (m - m0) >> 12]).astype(np.float64)
+    return _matmul_tables[kind]
+
+
+def _matmul(a, m):
+    a = a % g.Q
+    a -= (a > (g.Q >> 1))*g.Q
+    r = (a.astype(np.float64) @ m).astype(np.int64)
+    return (r[:, :g.N] + (r[:, g.N:] % g.Q)*4096) % g.Q
+
+
+##################################################
+# Name:        ntt_matmul
+#
+# Description: Forward NTT of a whole batch of polynomials as one exact
+#              modular matrix product through BLAS. The output is congruent
+#              to that of ntt() and consists of standard representatives.
+#
+# Arguments:   - np.ndarray a: int64 array of shape (n, N)
+#
+# Returns the transformed array.
+##################################################
+def ntt_matmul(a):
+    return _matmul(a, _matmul_table("ntt"))
+
+
+##################################################
+# Name:        invntt_tomont_matmul
+#
+# Description: Inverse NTT and multiplication by Montgomery factor 2^32 of a
+#              whole batch of polynomials as one exact modular matrix
+#              product. With plain arithmetic there is no factor 2^32. The
+#              output consists of standard representatives.
+#
+# Arguments:   - np.ndarray a: int64 array of shape (n, N)
+#
+# Returns the transformed array.
+##################################################
+def invntt_tomont_matmul(a):
+    return _matmul(a, _matmul_table(g.ARITH))
+
+
+##################################################
+# Name:        ntt_batch
+#
+# Description: Forward NTT of several coefficient arrays with the engine
+#              selected in g.NTT_ENGINE and the arithmetic selected in
+#              g.ARITH. In-place. The "blas" engine uses ntt_matmul() for at
+#              least g.NTT_BLAS_THRESHOLD arrays and ntt_array() below; the
+#              arrays of ntt_array() are spread over g.THREAD_POOL. The
+#              multiplication engines other than g.POLYMUL == "ntt" work on
+#              coefficients, so then this is the identity.
+#
+# Arguments:   - List[List[int]] polys: input/output coefficient arrays
+##################################################
+def ntt_batch(polys: List[List[int]]):
+    if g.POLYMUL != "ntt":
+        return
+    if g.NTT_ENGINE == "reference":
+        f = ntt_plain if g.ARITH == "plain" else ntt
+        for a in polys:
+            f(a)
+    elif g.NTT_ENGINE == "radix4":
+        for a in polys:
+            ntt_radix4(a)
+    elif g.NTT_ENGINE in ("numpy", "blas"):
+        _check_numpy()
+        a = ntt_batch_array(np.array(polys, dtype=np.int64))
+        for p, r in zip(polys, a):
+            set_coeffs(p, r)
+    else:
+        raise ValueError(f"Unknown NTT engine {g.NTT_ENGINE!r}")
+
+
+##################################################
+# Name:        invntt_tomont_batch
+#
+# Description: Inverse NTT and multiplication by 2^32 of several coefficient
+#              arrays with the engine selected in g.NTT_ENGINE. With plain
+#              arithmetic there is no factor 2^32. In-place. The "blas"
+#              engine is chosen by size as in ntt_batch(). Like ntt_batch()
+#              this is the identity unless g.POLYMUL == "ntt".
+#
+# Arguments:   - List[List[int]] polys: input/output coefficient arrays
+##################################################
+def invntt_tomont_batch(polys: List[List[int]]):
+    if g.POLYMUL != "ntt":
+        return
+    if g.NTT_ENGINE == "reference":
+        f = invntt_plain if g.ARITH == "plain" else invntt_tomont
+        for a in polys:
+            f(a)
+    elif g.NTT_ENGINE == "radix4":
+        for a in polys:
+            invntt_tomont_radix4(a)
+    elif g.NTT_ENGINE in ("numpy", "blas"):
+        _check_numpy()
+        a = invntt_tomont_batch_array(np.array(polys, dtype=np.int64))
+        for p, r in zip(polys, a):
+            set_coeffs(p, r)
+    else:
+        raise ValueError(f"Unknown NTT engine {g.NTT_ENGINE!r}")
+
+
+##################################################
+# Name:        ntt_batch_array
+#
+# Description: Array version of ntt_batch() for the batch functions: forward
+#              NTT of the rows of a with the engine selected in
+#              g.NTT_ENGINE. The scalar engines give exactly the output of
+#              ntt_array(), so the rows stay in the array engine for them.
+#              The array may be transformed in place, so use the returned
+#              one. Identity unless g.POLYMUL == "ntt".
+#
+# Arguments:   - np.ndarray a: contiguous int64 array of shape (n, N)
+#
+# Returns the transformed array.
+##################################################
+def ntt_batch_array(a):
+    if g.POLYMUL != "ntt":
+        return a
+    if g.NTT_ENGINE == "blas" and len(a) >= g.NTT_BLAS_THRESHOLD:
+        return ntt_matmul(a)
+    return map_rows(ntt_array, a)
+
+
+##################################################
+# Name:        invntt_tomont_batch_array
+#
+# Description: Array version of invntt_tomont_batch(), see ntt_batch_array().
+#
+# Arguments:   - np.ndarray a: contiguous int64 array of shape (n, N)
+#
+# Returns the transformed array.
+##################################################
+def invntt_tomont_batch_array(a):
+    if g.POLYMUL != "ntt":
+        return a
+    if g.NTT_ENGINE == "blas" and len(a) >= g.NTT_BLAS_THRESHOLD:
+        return invntt_tomont_matmul(a)
+    return map_rows(invntt_tomont_array, a)
+
+
+##################################################
+# Name:        invntt_standard
+#
+# Description: Whether invntt_tomont_batch() of n arrays yields standard
+#              representatives in [0, Q), as plain arithmetic and the "blas"
+#              matrix product do, instead of the (-Q, Q) of the Montgomery
+#              butterflies. Adding a short vector can then carry a
+#              coefficient past Q-1.
+#
+# Arguments:   - int n: number of arrays transformed together
+#
+# Returns True for standard representatives.
+##################################################
+def invntt_standard(n: int) -> bool:
+    if g.POLYMUL != "ntt":
+        return False
+    return g.ARITH == "plain" or (g.NTT_ENGINE == "blas" and n >= g.NTT_BLAS_THRESHOLD)
+
+
+def _check_numpy():
+    if np is None:
+        raise ImportError(f"NTT engine {g.NTT_ENGINE!r} requires numpy")
@@ -2,6 +2,7 @@
 from params import *
 from polyvec import *
 from poly import *
+from codec import *
 
 
 #################################################
@@ -14,14 +15,7 @@ from poly import *
 #              - polyveck t1: vector t1
 ##################################################
 def pack_pk(pk:List[int], rho:List[int], t1:polyveck):
-    for i in range(g.SEEDBYTES):
-        pk[i] = rho[i]
-    
-    temp = [0]*g.POLYT1_PACKEDBYTES
-    for i in range(g.K):
-        polyt1_pack(temp, t1.vec[i])
-        for j in range(g.POLYT1_PACKEDBYTES):
-            pk[g.SEEDBYTES + i*g.POLYT1_PACKEDBYTES + j] = temp[j]
+    pack_fields(pk, [("bytes", rho[:g.SEEDBYTES]), ("t1", t1.vec)])
 
 
 #################################################
@@ -34,11 +28,7 @@ def pack_pk(pk:List[int], rho:List[int], t1:polyveck):
 #              - List[int] pk: byte array containing bit-packed pk
 ##################################################
 def unpack_pk(rho:List[int], t1:polyveck, pk:List[int]):
-    for i in range(g.SEEDBYTES):
-        rho[i] = pk[i]
-
-    for i in range(g.K):
-        polyt1_unpack(t1.vec[i], pk[g.SEEDBYTES + i*g.POLYT1_PACKEDBYTES: g.SEEDBYTES + (i+1)*g.POLYT1_PACKEDBYTES])
+    unpack_fields(pk, [("bytes", rho), ("t1", t1.vec)])
 
 
 #################################################
@@ -55,38 +45,8 @@ def unpack_pk(rho:List[int], t1:polyveck, pk:List[int]):
 #              - polyveck s2: vector s2
 ##################################################
 def pack_sk(sk:List[int], rho:List[int], tr:List[int], key:List[int], t0:polyveck, s1:polyvecl, s2:polyveck):
-    start = 0
-    for i in range(g.SEEDBYTES):
-        sk[i] = rho[i]
-    start += g.SEEDBYTES
-
-    for i in range(g.SEEDBYTES):
-        sk[start+i] = key[i]
-    start += g.SEEDBYTES
-
-    for i in range(g.SEEDBYTES):
-        sk[start+i] = tr[i]
-    start += g.SEEDBYTES
-
-    for i in range(g.L):
-        temp = [0]*g.POLYETA_PACKEDBYTES
-        polyeta_pack(temp, s1.vec[i])
-        for j in range(g.POLYETA_PACKEDBYTES):
-            sk[start+i*g.POLYETA_PACKEDBYTES+j] = temp[j]
-    start += g.L*g.POLYETA_PACKEDBYTES
-
-    for i in range(g.K):
-        temp = [0]*g.POLYETA_PACKEDBYTES
-        polyeta_pack(temp, s2.vec[i])
-        for j in range(g.POLYETA_PACKEDBYTES):
-            sk[start+i*g.POLYETA_PACKEDBYTES+j] = temp[j]
-    start += g.K*g.POLYETA_PACKEDBYTES
-
-    for i in range(g.K):
-        temp = [0]*g.POLYT0_PACKEDBYTES
-        polyt0_pack(temp, t0.vec[i])
-        for j in range(g.POLYT0_PACKEDBYTES):
-            sk[start+i*g.POLYT0_PACKEDBYTES+j] = temp[j]
+    pack_fields(sk, [("bytes", rho[:g.SEEDBYTES]), ("bytes", key[:g.SEEDBYTES]), ("bytes", tr[:g.SEEDBYTES]),
+                     ("eta", s1.vec), ("eta", s2.vec), ("t0", t0.vec)])
 
 
 #################################################
@@ -103,29 +63,8 @@ def pack_sk(sk:List[int], rho:List[int], tr:List[int], key:List[int], t0:polyvec
 #              - List[int] sk: byte array containing bit-packed sk
 ##################################################
 def unpack_sk(rho:List[int], tr:List[int], key:List[int], t0:polyveck, s1:polyvecl, s2:polyveck, sk:List[int]):
-    start = 0
-    for i in range(g.SEEDBYTES):
-        rho[i] = sk[i]
-    start += g.SEEDBYTES
-
-    for i in range(g.SEEDBYTES):
-        key[i] = sk[start+i]
-    start += g.SEEDBYTES
-
-    for i in range(g.SEEDBYTES):
-        tr[i] = sk[start+i]
-    start += g.SEEDBYTES
-
-    for i in range(g.L):
-        polyeta_unpack(s1.vec[i], sk[start+i*g.POLYETA_PACKEDBYTES:start+(i+1)*g.POLYETA_PACKEDBYTES])
-    start += g.L*g.POLYETA_PACKEDBYTES
-
-    for i in range(g.K):
-        polyeta_unpack(s2.vec[i], sk[start+i*g.POLYETA_PACKEDBYTES:start+(i+1)*g.POLYETA_PACKEDBYTES])
-    start += g.K*g.POLYETA_PACKEDBYTES
-
-    for i in range(g.K):
-        polyt0_unpack(t0.vec[i], sk[start+i*g.POLYT0_PACKEDBYTES:start+(i+1)*g.POLYT0_PACKEDBYTES])
+    unpack_fields(sk, [("bytes", rho), ("bytes", key), ("bytes", tr),
+                       ("eta", s1.vec), ("eta", s2.vec), ("t0", t0.vec)])
 
 
 #################################################
@@ -139,29 +78,7 @@ def unpack_sk(rho:List[int], tr:List[int], key:List[int], t0:polyveck, s1:polyve
 #              - polyveck h: hint vector h
 ##################################################
 def pack_sig(sig:List[int], c:List[int], z:polyvecl, h:polyveck):
-    start = 0
-    for i in range(g.SEEDBYTES):
-        sig[i] = c[i]
-    start += g.SEEDBYTES
-
-    for i in range(g.L):
-        temp = [0]*g.POLYZ_PACKEDBYTES
-        polyz_pack(temp, z.vec[i])
-        for j in range(g.POLYZ_PACKEDBYTES):
-            sig[start+i*g.POLYZ_PACKEDBYTES+j] = temp[j]
-    start += g.L*g.POLYZ_PACKEDBYTES
-
-    for i in range(g.OMEGA):
-        sig[start+i] = 0
-
-    k=0
-    for i in range(g.K):
-        for j in range(g.N):
-            if h.vec[i].coeffs[j] != 0:
-                sig[start+k] = j
-                k += 1
-    
-        sig[start+g.OMEGA+i] = k
+    pack_fields(sig, [("bytes", c[:g.SEEDBYTES]), ("z", z.vec), ("hint", h.vec)])
 
 
 #################################################
@@ -178,31 +95,4 @@ def pack_sig(sig:List[int], c:List[int], z:polyvecl, h:polyveck):
 # Returns 1 in case of malformed signature; otherwise 0.
 ##################################################
 def unpack_sig(c:List[int], z:polyvecl, h:polyveck, sig:List[int]) -> int:
-    start = 0
-    for i in range(g.SEEDBYTES):
-        c[i] = sig[i]
-    start += g.SEEDBYTES
-
-    for i in range(g.L):
-        polyz_unpack(z.vec[i], sig[start+i*g.POLYZ_PACKEDBYTES:start+(i+1)*g.POLYZ_PACKEDBYTES])
-    start += g.L*g.POLYZ_PACKEDBYTES
-
-    k = 0
-    for i in range(g.K):
-        for j in range(g.N):
-            h.vec[i].coeffs[j] = 0
-
-        if sig[start+g.OMEGA+i] < k or sig[start+g.OMEGA+i] > g.OMEGA:
-            return 1
-
-        for j in range(k, sig[start+g.OMEGA+i]):
-            if j > k and sig[start+j] <= sig[start+j-1]:
-                return 1
-            h.vec[i].coeffs[sig[start+j]] = 1
-        k = sig[start+g.OMEGA+i]
-
-    for j in range(k, g.OMEGA):
-        if sig[start+j]:
-            return 1
-
-    return 0
+    return unpack_fields(sig, [("bytes", c), ("z", z.vec), ("hint", h.vec)])
@@ -0,0 +1,47 @@
+# Thread parallelism for the batch functions. The array kernels spend their
+# time in numpy loops, which release the GIL, so independent rows of a large
+# batch (the rows of A*y and A*z, the polynomials of an NTT batch) can run on
+# several cores at once. g.THREAD_POOL selects the concurrent.futures executor
+# they are spread over and g.THREAD_POOL_WORKERS the number of chunks; with
+# None everything runs in the calling thread. The vectors of a single
+# signature are too small to gain from a split, and the scalar reference code
+# holds the GIL, so neither is split.
+
+from params import *
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+#################################################
+# Name:        map_rows
+#
+# Description: Apply an array kernel to the rows of a along the first axis
+#              and join the results. With g.THREAD_POOL set, the rows are
+#              cut into at most g.THREAD_POOL_WORKERS chunks, each processing
+#              at least g.THREAD_POOL_MIN coefficients; every call of a
+#              kernel holds the GIL for a fixed Python overhead, so smaller
+#              chunks would be slower than one call. The kernel has to treat
+#              the rows independently.
+#
+# Arguments:   - f: kernel mapping an array of rows to an array of results
+#              - np.ndarray a: input rows
+#              - int axis: axis of the results that the rows map to
+#              - int cost: coefficients processed per row, by default the
+#                          size of a row
+#
+# Returns f(a).
+##################################################
+def map_rows(f, a, axis: int = 0, cost: int = None):
+    if g.THREAD_POOL is None or len(a) < 2:
+        return f(a)
+    if cost is None:
+        cost = a[0].size
+    workers = g.THREAD_POOL_WORKERS or os.cpu_count() or 1
+    chunks = min(workers, len(a), len(a)*cost // g.THREAD_POOL_MIN)
+    if chunks < 2:
+        return f(a)
+    return np.concatenate(list(g.THREAD_POOL.map(f, np.array_split(a, chunks))), axis=axis)
@@ -11,6 +11,25 @@ class Parameters:
     D = 13
     ROOT_OF_UNITY = 1753
 
+    # Implementation engines. They are not part of the parameter sets, so
+    # they are class attributes and survive set_mode().
+    NTT_ENGINE = "reference" # "reference", "radix4", "numpy" or "blas"
+    NTT_BLAS_THRESHOLD = 1024 # smallest batch the "blas" engine multiplies
+    ARITH = "montgomery"     # "montgomery" or "plain"
+    POLYMUL = "ntt"          # "ntt", "kronecker" or "fft"
+    KERNELS = "reference"    # "reference" or "numpy"
+    ROUNDING = "arith"       # "arith" or "tables"
+    SAMPLER = "reference"    # "reference" or "numpy"
+    STORAGE = "list"         # "list" or "array"
+    CHALLENGE = "ntt"        # "ntt" or "sparse"
+    MATRIX_CACHE = None      # matcache.MatrixCache used by polyvec_matrix()
+    THREAD_POOL = None       # executor for the array kernels, see parallel.py
+    THREAD_POOL_MIN = 1 << 13 # coefficients per task of THREAD_POOL
+    THREAD_POOL_WORKERS = None # chunks per task of THREAD_POOL, None for os.cpu_count()
+    ROUNDING_TABLE_DIR = None # where "tables" keeps its files, None for ~/.cache/dilithium
+    ENGINES = ("NTT_ENGINE", "NTT_BLAS_THRESHOLD", "ARITH", "POLYMUL", "KERNELS",
+               "ROUNDING", "SAMPLER", "STORAGE", "CHALLENGE", "ROUNDING_TABLE_DIR")
+
     def __init__(self, mode:int):
         assert mode in [2, 3, 5]
         self.DILITHIUM_MODE = mode
@@ -81,4 +100,15 @@ class Parameters:
         assert mode in [2, 3, 5]
         self.__init__(mode)
 
+    # Mode and engines, for worker processes that must compute the same way
+    def snapshot(self) -> tuple:
+        return (self.DILITHIUM_MODE,) + tuple(getattr(self, name) for name in self.ENGINES)
+
+    def restore(self, state: tuple):
+        if state == self.snapshot():
+            return
+        self.set_mode(state[0])
+        for name, value in zip(self.ENGINES, state[1:]):
+            setattr(self, name, value)
+
 g = Parameters(2)
@@ -4,21 +4,75 @@ from ntt import *
 from reduce import *
 from rounding import *
 from symmetric import *
+from polymul import *
+from codec import *
+from parallel import *
+from storage import *
 
 
 class poly:
+    __slots__ = ("coeffs",)
     coeffs: List[int]
 
     def __init__(self, inp: list[int] = None):
         if inp is None:
-            inp = [0 for _ in range(g.N)]
+            self.coeffs = zero_coeffs(g.N)
+            return
         if len(inp) > g.N:
             raise ValueError("Polynomial can't have more than N coeffs")
+        if g.STORAGE == "array" and type(inp) is list:
+            inp = array('q', inp)
         if len(inp) < g.N:
-            inp = inp + [0 for _ in range(g.N-len(inp))].copy()
+            inp = inp + zero_coeffs(g.N-len(inp))
         self.coeffs = inp
 
 
+#################################################
+# Name:        poly_block
+#
+# Description: Allocate n zero polynomials. With g.STORAGE == "array" they
+#              are rows of one array('q') block, which is returned as well.
+#
+# Arguments:   - int n: number of polynomials
+#
+# Returns tuple (block, List[poly]); block is None for list storage.
+##################################################
+def poly_block(n: int):
+    if g.STORAGE == "array":
+        block = zero_coeffs(n*g.N)
+        return block, [poly(r) for r in block_rows(block)]
+    return None, [poly() for _ in range(n)]
+
+
+#################################################
+# Name:        polys_to_array
+#
+# Description: Copy the coefficients of several polynomials into one int64
+#              array for the array kernels (g.KERNELS == "numpy").
+#
+# Arguments:   - List[poly] polys: input polynomials
+#
+# Returns array of shape (len(polys), N).
+##################################################
+def polys_to_array(polys: List[poly]):
+    if np is None:
+        raise ImportError("The numpy kernels require numpy")
+    return np.array([p.coeffs for p in polys], dtype=np.int64)
+
+
+#################################################
+# Name:        polys_from_array
+#
+# Description: Write the rows of an array back into several polynomials.
+#
+# Arguments:   - List[poly] polys: output polynomials
+#              - np.ndarray a: array of shape (len(polys), N)
+##################################################
+def polys_from_array(polys: List[poly], a):
+    for p, r in zip(polys, a):
+        set_coeffs(p.coeffs, r)
+
+
 #################################################
 # Name:        poly_reduce
 #
@@ -28,6 +82,10 @@ class poly:
 # Arguments:   - poly a: input/output polynomial
 ##################################################
 def poly_reduce(a: poly):
+    if g.KERNELS == "numpy":
+        polys_from_array([a], reduce32_array(polys_to_array([a])))
+        return
+
     for i in range(g.N):
         a.coeffs[i] = reduce32(a.coeffs[i])
 
@@ -41,6 +99,10 @@ def poly_reduce(a: poly):
 # Arguments:   - poly a: input/output polynomial
 ##################################################
 def poly_caddq(a: poly):
+    if g.KERNELS == "numpy":
+        polys_from_array([a], caddq_array(polys_to_array([a])))
+        return
+
     for i in range(g.N):
         a.coeffs[i] = caddq(a.coeffs[i])
 
@@ -84,6 +146,10 @@ def poly_sub(c: poly, a: poly, b: poly):
 # Arguments:   - poly a: input/output polynomial
 ##################################################
 def poly_shiftl(a: poly):
+    if g.KERNELS == "numpy":
+        polys_from_array([a], polys_to_array([a]) << g.D)
+        return
+
     for i in range(g.N):
         a.coeffs[i] <<= g.D
 
@@ -97,7 +163,7 @@ def poly_shiftl(a: poly):
 # Arguments:   - poly a: input/output polynomial
 ##################################################
 def poly_ntt(a: poly):
-    ntt(a.coeffs)
+    ntt_batch([a.coeffs])
 
 
 #################################################
@@ -110,7 +176,7 @@ def poly_ntt(a: poly):
 # Arguments:   - poly a: input/output polynomial
 ##################################################
 def poly_invntt_tomont(a: poly):
-    invntt_tomont(a.coeffs)
+    invntt_tomont_batch([a.coeffs])
 
 
 #################################################
@@ -118,13 +184,27 @@ def poly_invntt_tomont(a: poly):
 #
 # Description: Pointwise multiplication of polynomials in NTT domain
 #              representation and multiplication of resulting polynomial
-#              by 2^{-32}.
+#              by 2^{-32}. With plain arithmetic the products are reduced
+#              mod Q and there is no factor 2^{-32}. With a coefficient
+#              domain engine in g.POLYMUL this is the negacyclic product.
 #
 # Arguments:   - poly c: output polynomial
 #              - poly a: first input polynomial
 #              - poly b: second input polynomial
 ##################################################
 def poly_pointwise_montgomery(c: poly, a: poly, b: poly):
+    if g.POLYMUL == "kronecker":
+        set_coeffs(c.coeffs, kron_mul(a.coeffs, b.coeffs))
+        return
+    if g.POLYMUL == "fft":
+        set_coeffs(c.coeffs, fft_mul(a.coeffs, b.coeffs))
+        return
+
+    if g.ARITH == "plain":
+        Q = g.Q
+        set_coeffs(c.coeffs, [x*y % Q for x, y in zip(a.coeffs, b.coeffs)])
+        return
+
     for i in range(g.N):
         c.coeffs[i] = montgomery_reduce(a.coeffs[i] * b.coeffs[i])
 
@@ -142,6 +222,12 @@ def poly_pointwise_montgomery(c: poly, a: poly, b: poly):
 #              - poly a: input polynomial
 ##################################################
 def poly_power2round(a1: poly, a0: poly, a: poly):
+    if g.KERNELS == "numpy":
+        r0, r1 = power2round_array(polys_to_array([a]))
+        polys_from_array([a0], r0)
+        polys_from_array([a1], r1)
+        return
+
     for i in range(g.N):
         a0.coeffs[i], a1.coeffs[i] = power2round(a.coeffs[i])
 
@@ -160,10 +246,63 @@ def poly_power2round(a1: poly, a0: poly, a: poly):
 #              - poly a: input polynomial
 ##################################################
 def poly_decompose(a1: poly, a0: poly, a: poly):
+    if g.KERNELS == "numpy":
+        r0, r1 = decompose_array(polys_to_array([a]))
+        polys_from_array([a0], r0)
+        polys_from_array([a1], r1)
+        return
+
+    if g.ROUNDING == "tables":
+        t = rounding_table()[0]
+        set_coeffs(a1.coeffs, [t[x] for x in a.coeffs])
+        set_coeffs(a0.coeffs, [lowbits(x, y) for x, y in zip(a.coeffs, a1.coeffs)])
+        return
+
     for i in range(g.N):
         a0.coeffs[i], a1.coeffs[i] = decompose(a.coeffs[i])
 
 
+#################################################
+# Name:        poly_highbits
+#
+# Description: High bits of poly_decompose alone, see highbits().
+#
+# Arguments:   - poly a1: output polynomial with coefficients c1
+#              - poly a: input polynomial
+##################################################
+def poly_highbits(a1: poly, a: poly):
+    if g.KERNELS == "numpy":
+        polys_from_array([a1], highbits_array(polys_to_array([a])))
+        return
+
+    if g.ROUNDING == "tables":
+        t = rounding_table()[0]
+        set_coeffs(a1.coeffs, [t[x] for x in a.coeffs])
+        return
+
+    for i in range(g.N):
+        a1.coeffs[i] = highbits(a.coeffs[i])
+
+
+#################################################
+# Name:        poly_lowbits
+#
+# Description: Low bits of poly_decompose from the polynomial and its high
+#              bits, see lowbits().
+#
+# Arguments:   - poly a0: output polynomial with coefficients c0
+#              - poly a: input polynomial
+#              - poly a1: high bits of a
+##################################################
+def poly_lowbits(a0: poly, a: poly, a1: poly):
+    if g.KERNELS == "numpy":
+        polys_from_array([a0], lowbits_array(polys_to_array([a]), polys_to_array([a1])))
+        return
+
+    for i in range(g.N):
+        a0.coeffs[i] = lowbits(a.coeffs[i], a1.coeffs[i])
+
+
 #################################################
 # Name:        poly_make_hint
 #
@@ -178,6 +317,11 @@ def poly_decompose(a1: poly, a0: poly, a: poly):
 # Returns number of 1 bits.
 ##################################################
 def poly_make_hint(h: poly, a0: poly, a1: poly):
+    if g.KERNELS == "numpy":
+        r = make_hint_array(polys_to_array([a0]), polys_to_array([a1]))
+        polys_from_array([h], r)
+        return int(r.sum())
+
     s = 0
     for i in range(g.N):
         h.coeffs[i] = int(make_hint(a0.coeffs[i], a1.coeffs[i]))
@@ -195,6 +339,15 @@ def poly_make_hint(h: poly, a0: poly, a1: poly):
 #              - poly h: input hint polynomial
 ##################################################
 def poly_use_hint(b: poly, a: poly, h:poly):
+    if g.KERNELS == "numpy":
+        polys_from_array([b], use_hint_array(polys_to_array([a]), polys_to_array([h])))
+        return
+
+    if g.ROUNDING == "tables":
+        t, Q = rounding_table()[0], g.Q
+        set_coeffs(b.coeffs, [t[y*Q + x] for x, y in zip(a.coeffs, h.coeffs)])
+        return
+
     for i in range(g.N):
         b.coeffs[i] = use_hint(a.coeffs[i], h.coeffs[i])
 
@@ -214,6 +367,9 @@ def poly_chknorm(a: poly, B: int) -> int:
     if B > (g.Q-1)//8:
         return 1
 
+    if g.KERNELS == "numpy":
+        return chknorm_array(polys_to_array([a]), B)
+
     for i in range(g.N):
         t = a.coeffs[i] >> 31
         t = a.coeffs[i] - (t & 2*a.coeffs[i])
@@ -224,6 +380,89 @@ def poly_chknorm(a: poly, B: int) -> int:
     return 0
 
 
+#################################################
+# Name:        chknorm_array
+#
+# Description: Check infinity norm of all coefficients of an array of
+#              polynomials against given bound in one comparison. Assumes
+#              input coefficients were reduced by reduce32().
+#
+# Arguments:   - np.ndarray a: int64 array of coefficients
+#              - int B: norm bound
+#
+# Returns 0 if norm is strictly smaller than B <= (Q-1)/8 and 1 otherwise.
+##################################################
+def chknorm_array(a, B: int) -> int:
+    if B > (g.Q-1)//8:
+        return 1
+    return int(bool((np.abs(a) >= B).any()))
+
+
+#################################################
+# Name:        rej_uniform_array
+#
+# Description: Array version of rej_uniform. Decodes all 3-byte words of buf
+#              at once and keeps those below Q.
+#
+# Arguments:   - bytes buf: random bytes, length a multiple of 3
+#
+# Returns int64 array of all accepted coefficients in stream order.
+##################################################
+def rej_uniform_array(buf: bytes):
+    b = np.frombuffer(buf, dtype=np.uint8).reshape(-1, 3).astype(np.int64)
+    t = (b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)) & 0x7FFFFF
+    return t[t < g.Q]
+
+
+#################################################
+# Name:        rej_eta_array
+#
+# Description: Array version of rej_eta. Splits all bytes of buf into
+#              nibbles, low nibble first, and maps the accepted ones to
+#              [-ETA, ETA].
+#
+# Arguments:   - bytes buf: random bytes
+#
+# Returns int64 array of all accepted coefficients in stream order.
+##################################################
+def rej_eta_array(buf: bytes):
+    b = np.frombuffer(buf, dtype=np.uint8).astype(np.int64)
+    t = np.stack((b & 0x0F, b >> 4), axis=1).ravel()
+    if g.ETA == 2:
+        t = t[t < 15]
+        return 2 - t % 5
+    return 4 - t[t < 9]
+
+
+# Blocks squeezed on top of the reference amount by the numpy samplers, so
+# that the refill loop of sample_array almost never runs.
+SAMPLER_EXTRA_BLOCKS = 1
+
+
+#################################################
+# Name:        sample_array
+#
+# Description: Rejection sampling of one polynomial with the array
+#              samplers. Since both samplers parse the stream in units that
+#              divide the block size, squeezing more bytes up front accepts
+#              exactly the same coefficients as the block-wise reference.
+#
+# Arguments:   - state: initialized XOF state
+#              - int nblocks: number of blocks squeezed up front
+#              - int blockbytes: block size of the XOF
+#              - rej: rej_uniform_array or rej_eta_array
+#
+# Returns int64 array of the N sampled coefficients.
+##################################################
+def sample_array(state, nblocks: int, blockbytes: int, rej):
+    if np is None:
+        raise ImportError("The numpy sampler requires numpy")
+    t = rej(state.read(nblocks*blockbytes))
+    while len(t) < g.N:
+        t = np.concatenate((t, rej(state.read(blockbytes))))
+    return t[:g.N]
+
+
 #################################################
 # Name:        rej_uniform
 #
@@ -268,6 +507,13 @@ def rej_uniform(a:List[int], l:int, buf: List[int], buflen:int) -> int:
 ##################################################
 POLY_UNIFORM_NBLOCKS = ((768 + STREAM128_BLOCKBYTES - 1)//STREAM128_BLOCKBYTES)
 def poly_uniform(a: poly, seed: bytes, nonce: int):
+    if g.SAMPLER == "numpy":
+        state = stream128_state()
+        stream128_init(state, seed, nonce)
+        polys_from_array([a], sample_array(state, POLY_UNIFORM_NBLOCKS + SAMPLER_EXTRA_BLOCKS,
+                                           STREAM128_BLOCKBYTES, rej_uniform_array)[None])
+        return
+
     buflen = POLY_UNIFORM_NBLOCKS*STREAM128_BLOCKBYTES
     buf = [0]*(POLY_UNIFORM_NBLOCKS*STREAM128_BLOCKBYTES + 2)
     state = stream128_state()
@@ -348,6 +594,13 @@ def rej_eta(a:List[int], l:int, buf:List[int], buflen:int) -> int:
 # elif g.ETA == 4:
 #     g.POLY_UNIFORM_ETA_NBLOCKS = ((227 + STREAM256_BLOCKBYTES - 1)//STREAM256_BLOCKBYTES)
 def poly_uniform_eta(a:poly, seed:List[int], nonce:int):
+    if g.SAMPLER == "numpy":
+        state = stream256_state()
+        stream256_init(state, bytes(seed), nonce)
+        polys_from_array([a], sample_array(state, g.POLY_UNIFORM_ETA_NBLOCKS + SAMPLER_EXTRA_BLOCKS,
+                                           STREAM256_BLOCKBYTES, rej_eta_array)[None])
+        return
+
     buflen = g.POLY_UNIFORM_ETA_NBLOCKS*STREAM256_BLOCKBYTES
     buf = [0]*(g.POLY_UNIFORM_ETA_NBLOCKS*STREAM256_BLOCKBYTES)
     state = stream256_state()
@@ -427,6 +680,56 @@ def poly_challenge(c:poly, seed:List[int]):
         signs >>= 1
 
 
+#################################################
+# Name:        challenge_sparse
+#
+# Description: Sparse form of a challenge polynomial from poly_challenge().
+#
+# Arguments:   - poly c: challenge polynomial
+#
+# Returns list of the TAU pairs (index, sign) of the nonzero coefficients.
+##################################################
+def challenge_sparse(c: poly) -> List[tuple[int, int]]:
+    return [(i, x) for i, x in enumerate(c.coeffs) if x != 0]
+
+
+#################################################
+# Name:        poly_challenge_mul
+#
+# Description: Exact negacyclic product r = c*a of a sparse challenge and a
+#              polynomial in coefficient representation. X^i*a is the slice
+#              [N-i, 2N-i) of the concatenation (-a, a), so the product is a
+#              column sum of TAU signed slices; no NTT is needed.
+#
+# Arguments:   - poly r: output polynomial
+#              - List[tuple[int, int]] c: sparse challenge
+#              - poly a: input polynomial
+##################################################
+def poly_challenge_mul(r: poly, c: List[tuple[int, int]], a: poly):
+    N = g.N
+    pos = list(a.coeffs)
+    neg = [-x for x in pos]
+    ext = (neg + pos, pos + neg)
+    set_coeffs(r.coeffs, list(map(sum, zip(*[ext[s < 0][N-i:2*N-i] for i, s in c]))))
+
+
+#################################################
+# Name:        challenge_mul_array
+#
+# Description: Array version of poly_challenge_mul for several polynomials.
+#
+# Arguments:   - List[tuple[int, int]] c: sparse challenge
+#              - np.ndarray a: int64 array of shape (n, N)
+#
+# Returns int64 array of shape (n, N).
+##################################################
+def challenge_mul_array(c: List[tuple[int, int]], a):
+    ext = np.concatenate((-a, a), axis=-1)
+    idx = np.array([g.N - i for i, _ in c])[:, None] + np.arange(g.N)
+    signs = np.array([s for _, s in c])[:, None]
+    return (ext[:, idx]*signs).sum(axis=1)
+
+
 #################################################
 # Name:        polyeta_pack
 #
@@ -728,6 +1031,20 @@ def polyz_unpack(r:poly, a:List[int]):
             r.coeffs[2*i+1] = g.GAMMA1 - r.coeffs[2*i+1]
 
 
+#################################################
+# Name:        polyz_unpack_array
+#
+# Description: Array version of polyz_unpack. Decodes several consecutive
+#              packed polynomials at once with the codec of codec.py.
+#
+# Arguments:   - bytes a: byte array with n bit-packed polynomials
+#
+# Returns int64 array of shape (n, N).
+##################################################
+def polyz_unpack_array(a: bytes):
+    return unpack_array(a, *codec_spec("z"))
+
+
 #################################################
 # Name:        polyw1_pack
 #
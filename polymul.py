@@ -0,0 +1,137 @@
+# Multiplication engines for Z_q[X]/(X^N+1) that work directly on
+# coefficients. They stand in for the sequence NTT -> pointwise product ->
+# inverse NTT when g.POLYMUL is not "ntt".
+
+from params import *
+from array import array
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Width of one coefficient slot in the packed integers. A product of two
+# standard representatives summed over N terms and up to 8 accumulated
+# products stays below 2^{3+8+46} < 2^64.
+KRON_SLOTBYTES = 8
+
+
+##################################################
+# Name:        kron_pack
+#
+# Description: Kronecker substitution. Evaluates the polynomial with standard
+#              representatives of its coefficients at X = 2^64.
+#
+# Arguments:   - List[int] a: coefficient array
+#
+# Returns the packed integer.
+##################################################
+def kron_pack(a: List[int]) -> int:
+    Q = g.Q
+    t = array('Q', [x % Q for x in a])
+    if sys.byteorder == "big":
+        t.byteswap()
+    return int.from_bytes(t.tobytes(), 'little')
+
+
+##################################################
+# Name:        kron_unpack
+#
+# Description: Inverse of kron_pack for a product of packed polynomials.
+#              Splits the integer into its 2N slots and folds the upper half
+#              back negacyclically (X^N = -1).
+#
+# Arguments:   - int x: packed product
+#
+# Returns coefficient array with standard representatives.
+##################################################
+def kron_unpack(x: int) -> List[int]:
+    Q = g.Q
+    t = array('Q')
+    t.frombytes(x.to_bytes(2*g.N*KRON_SLOTBYTES, 'little'))
+    if sys.byteorder == "big":
+        t.byteswap()
+    return [(lo - hi) % Q for lo, hi in zip(t[:g.N], t[g.N:])]
+
+
+##################################################
+# Name:        kron_mul
+#
+# Description: Negacyclic product c = a*b of polynomials in coefficient
+#              representation using one big integer multiplication.
+#
+# Arguments:   - List[int] a: first input coefficient array
+#              - List[int] b: second input coefficient array
+#
+# Returns coefficient array of the product.
+##################################################
+def kron_mul(a: List[int], b: List[int]) -> List[int]:
+    return kron_unpack(kron_pack(a)*kron_pack(b))
+
+
+##################################################
+# Name:        kron_mul_acc
+#
+# Description: Inner product sum_i a_i*b_i of two vectors of polynomials.
+#              The products are accumulated in packed form and unpacked once.
+#
+# Arguments:   - List[List[int]] a: first input vector of coefficient arrays
+#              - List[int] b: second input vector, already packed
+#
+# Returns coefficient array of the inner product.
+##################################################
+def kron_mul_acc(a: List[List[int]], b: List[int]) -> List[int]:
+    acc = 0
+    for x, y in zip(a, b):
+        acc += kron_pack(x)*y
+    return kron_unpack(acc)
+
+
+# The FFT engine splits standard representatives centered around zero into
+# two balanced limbs of 12 bits, a = a0 + a1*2^12 with |a0|, |a1| <= 2^11. A
+# limb product summed over N coefficients and 8 accumulated products is below
+# 2^{22+8+3+1} = 2^34, far inside the 53 bits that float64 holds exactly, so
+# rounding the inverse FFT gives the exact integer convolution.
+FFT_LIMBBITS = 12
+
+
+def _fft_split(a):
+    a = np.asarray(a, dtype=np.int64) % g.Q
+    a -= (a > (g.Q >> 1))*g.Q
+    a0 = ((a + (1 << (FFT_LIMBBITS-1))) & ((1 << FFT_LIMBBITS) - 1)) - (1 << (FFT_LIMBBITS-1))
+    a1 = (a - a0) >> FFT_LIMBBITS
+    return np.fft.rfft(a0, 2*g.N), np.fft.rfft(a1, 2*g.N)
+
+
+def _fft_join(p):
+    c = [np.rint(np.fft.irfft(x, 2*g.N)).astype(np.int64) % g.Q for x in p]
+    c = (c[0] + c[1]*(1 << FFT_LIMBBITS) + c[2]*((1 << 2*FFT_LIMBBITS) % g.Q)) % g.Q
+    return (c[..., :g.N] - c[..., g.N:]) % g.Q
+
+
+##################################################
+# Name:        fft_mul
+#
+# Description: Negacyclic products of polynomials in coefficient
+#              representation with float64 FFTs. The inputs are broadcast
+#              against each other like numpy arrays, so one call multiplies
+#              whole vectors or matrices of polynomials. With acc set the
+#              products are also summed along the second to last axis, which
+#              gives matrix-vector products such as A*y.
+#
+# Arguments:   - a: first input, array-like of shape (..., N)
+#              - b: second input, array-like of shape (..., N)
+#              - bool acc: sum the products along axis -2
+#
+# Returns int64 array of products with standard representatives.
+##################################################
+def fft_mul(a, b, acc: bool = False):
+    if np is None:
+        raise ImportError("The fft multiplication engine requires numpy")
+    a0, a1 = _fft_split(a)
+    b0, b1 = _fft_split(b)
+    p = [a0*b0, a0*b1 + a1*b0, a1*b1]
+    if acc:
+        p = [x.sum(axis=-2) for x in p]
+    return _fft_join(p)
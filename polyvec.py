@@ -1,31 +1,44 @@
 # Contains elements from polyvec.h and polyvec.c
 from params import *
 from poly import *
+from codec import *
+from parallel import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 class polyvecl:
+    __slots__ = ("vec", "block")
     vec: List[poly]
 
     def __init__(self, inp: list[poly] = None):
+        self.block = None
         if inp is None:
-            inp = [poly() for _ in range(g.L)]
+            self.block, self.vec = poly_block(g.L)
+            return
         if len(inp) > g.L:
             raise ValueError("Polynomial Vector L can't have more than L polys")
         if len(inp) < g.L:
-            inp = inp + [poly() for _ in range(g.L-len(inp))].copy()
+            inp = inp + [poly() for _ in range(g.L-len(inp))]
         self.vec = inp
 
 
 class polyveck:
+    __slots__ = ("vec", "block")
     vec: List[poly]
 
     def __init__(self, inp: list[poly] = None):
+        self.block = None
         if inp is None:
-            inp = [poly() for _ in range(g.K)]
+            self.block, self.vec = poly_block(g.K)
+            return
         if len(inp) > g.K:
             raise ValueError("Polynomial Vector K can't have more than K polys")
         if len(inp) < g.K:
-            inp = inp + [poly() for _ in range(g.K-len(inp))].copy()
+            inp = inp + [poly() for _ in range(g.K-len(inp))]
         self.vec = inp
 
 #################################################
@@ -34,18 +47,161 @@ class polyveck:
 # Description: Implementation of ExpandA. Generates matrix A with uniformly
 #              random coefficients a_{i,j} by performing rejection
 #              sampling on the output stream of SHAKE128(rho|j|i)
-#              or AES256CTR(rho,j|i).
+#              or AES256CTR(rho,j|i). The matrix is sampled in the NTT
+#              domain; the coefficient domain engines of g.POLYMUL get it
+#              transformed back.
 #
 # Arguments:   - polyvecl mat[K]: output matrix
 #              - List[int] rho: byte array containing seed rho
 ##################################################
 def polyvec_matrix_expand(mat: List[polyvecl], rho: List[int]):
+    if np is not None and isinstance(mat, np.ndarray):
+        p = poly()
+        for i in range(g.K):
+            for j in range(g.L):
+                poly_uniform(p, bytes(rho), (i<<8) + j)
+                if g.POLYMUL != "ntt":
+                    invntt_plain(p.coeffs)
+                mat[i, j] = p.coeffs
+        return
+
     for i in range(g.K):
-        for j in range(g.L):
-            poly_uniform(mat[i].vec[j], bytes(rho), (i<<8) + j)
+        polyvec_matrix_expand_row(mat[i], rho, i)
+
+
+#################################################
+# Name:        polyvec_matrix_expand_row
+#
+# Description: Generate row i of the matrix A, see polyvec_matrix_expand.
+#
+# Arguments:   - polyvecl row: output row
+#              - List[int] rho: byte array containing seed rho
+#              - int i: index of the row
+##################################################
+def polyvec_matrix_expand_row(row: polyvecl, rho: List[int], i: int):
+    for j in range(g.L):
+        poly_uniform(row.vec[j], bytes(rho), (i<<8) + j)
+        if g.POLYMUL != "ntt":
+            invntt_plain(row.vec[j].coeffs)
+
+
+#################################################
+# Name:        matrix_stream
+#
+# Description: The matrix A kept as its seed. polyvec_matrix_pointwise_montgomery
+#              generates one row at a time, multiplies it and drops it, so
+#              only one row is in memory, at the price of expanding A again
+#              for every product.
+#
+# Arguments:   - List[int] rho: byte array containing seed rho
+##################################################
+class matrix_stream:
+    __slots__ = ("rho",)
+
+    def __init__(self, rho: List[int]):
+        self.rho = bytes(rho)
+
+
+#################################################
+# Name:        polyvec_matrix_new
+#
+# Description: Allocate the matrix A. With g.KERNELS == "numpy" it is one
+#              (K, L, N) int64 tensor, otherwise a list of K polyvecl. Both
+#              are accepted by polyvec_matrix_expand and
+#              polyvec_matrix_pointwise_montgomery.
+#
+# Returns the zero matrix.
+##################################################
+def polyvec_matrix_new():
+    if g.KERNELS == "numpy":
+        if np is None:
+            raise ImportError("The numpy kernels require numpy")
+        return np.zeros((g.K, g.L, g.N), dtype=np.int64)
+    return [polyvecl() for _ in range(g.K)]
+
+
+#################################################
+# Name:        polyvec_matrix
+#
+# Description: Allocate and expand the matrix A for rho. With a cache in
+#              g.MATRIX_CACHE the matrix comes from there.
+#
+# Arguments:   - List[int] rho: byte array containing seed rho
+#              - bool stream: return a matrix_stream instead, which expands
+#                             the rows when they are used
+#
+# Returns the matrix, see polyvec_matrix_new().
+##################################################
+def polyvec_matrix(rho: List[int], stream: bool = False):
+    if stream:
+        return matrix_stream(rho)
+    if g.MATRIX_CACHE is not None:
+        return g.MATRIX_CACHE.matrix(rho)
+    mat = polyvec_matrix_new()
+    polyvec_matrix_expand(mat, rho)
+    return mat
+
+
+#################################################
+# Name:        matrix_pointwise_array
+#
+# Description: Product A*v of the matrix tensor with a stack of vectors. The
+#              pointwise products of all entries are formed in one broadcast
+#              multiplication, summed over L and reduced once. The sums stay
+#              below 2^53 for NTT domain inputs, inside the range of
+#              montgomery_reduce_array. With a coefficient domain engine in
+#              g.POLYMUL the negacyclic products are summed instead. The rows
+#              of A are spread over g.THREAD_POOL.
+#
+# Arguments:   - np.ndarray A: matrix of shape (K, L, N)
+#              - np.ndarray v: vectors of shape (..., L, N)
+#
+# Returns int64 array of shape (..., K, N).
+##################################################
+def matrix_pointwise_array(A, v):
+    return map_rows(lambda rows: _matrix_pointwise_rows(rows, v), A, axis=-2, cost=v.size)
+
+
+def _matrix_pointwise_rows(A, v):
+    v = v[..., None, :, :]
+    if g.POLYMUL == "fft":
+        return fft_mul(A, v, acc=True)
+    if g.POLYMUL == "kronecker":
+        r = np.empty(v.shape[:-3] + (len(A), g.N), dtype=np.int64)
+        for idx in np.ndindex(v.shape[:-3]):
+            vp = [kron_pack(x) for x in v[idx][0].tolist()]
+            for i in range(len(A)):
+                r[idx + (i,)] = kron_mul_acc(A[i].tolist(), vp)
+        return r
+
+    p = (A*v).sum(axis=-2)
+    if g.ARITH == "plain":
+        return p % g.Q
+    return montgomery_reduce_array(p)
 
 
 def polyvec_matrix_pointwise_montgomery(t:polyveck, mat:List[polyvecl], v:polyvecl):
+    if isinstance(mat, matrix_stream):
+        row = polyvecl()
+        for i in range(g.K):
+            polyvec_matrix_expand_row(row, mat.rho, i)
+            polyvecl_pointwise_acc_montgomery(t.vec[i], row, v)
+        return
+    if np is not None and isinstance(mat, np.ndarray):
+        polys_from_array(t.vec, matrix_pointwise_array(mat, polys_to_array(v.vec)))
+        return
+    if g.POLYMUL == "kronecker":
+        vp = [kron_pack(v.vec[j].coeffs) for j in range(g.L)]
+        for i in range(g.K):
+            set_coeffs(t.vec[i].coeffs, kron_mul_acc([mat[i].vec[j].coeffs for j in range(g.L)], vp))
+        return
+    if g.POLYMUL == "fft":
+        r = fft_mul([[mat[i].vec[j].coeffs for j in range(g.L)] for i in range(g.K)],
+                    [v.vec[j].coeffs for j in range(g.L)], acc=True)
+        for i in range(g.K):
+            set_coeffs(t.vec[i].coeffs, r[i])
+        return
+
     for i in range(g.K):
         polyvecl_pointwise_acc_montgomery(t.vec[i], mat[i], v)
 
@@ -61,11 +217,24 @@ def polyvecl_uniform_eta(v:polyvecl, seed:List[int], nonce:int):
 
 
 def polyvecl_uniform_gamma1(v: polyvecl, seed:List[int], nonce:int):
+    if g.SAMPLER == "numpy":
+        buf = []
+        for i in range(g.L):
+            state = stream256_state()
+            stream256_init(state, bytes(seed), g.L*nonce + i)
+            buf.append(state.read(g.POLYZ_PACKEDBYTES))
+        polys_from_array(v.vec, polyz_unpack_array(b"".join(buf)))
+        return
+
     for i in range(g.L):
         poly_uniform_gamma1(v.vec[i], seed, g.L*nonce+i)
 
 
 def polyvecl_reduce(v:polyvecl):
+    if g.KERNELS == "numpy":
+        polys_from_array(v.vec, reduce32_array(polys_to_array(v.vec)))
+        return
+
     for i in range(g.L):
         poly_reduce(v.vec[i])
 
@@ -94,8 +263,7 @@ def polyvecl_add(w:polyvecl, u:polyvecl, v:polyvecl):
 # Arguments:   - polyvecl v: input/output vector
 ##################################################
 def polyvecl_ntt(v:polyvecl):
-    for i in range(g.L):
-        poly_ntt(v.vec[i])
+    ntt_batch([v.vec[i].coeffs for i in range(g.L)])
 
 
 #################################################
@@ -108,11 +276,21 @@ def polyvecl_ntt(v:polyvecl):
 # Arguments:   - polyvecl *v: pointer to input/output vector
 ##################################################
 def polyvecl_invntt_tomont(v:polyvecl):
-    for i in range(g.L):
-        poly_invntt_tomont(v.vec[i])
+    invntt_tomont_batch([v.vec[i].coeffs for i in range(g.L)])
 
 
 def polyvecl_pointwise_poly_montgomery(r:polyvecl, a:poly, v:polyvecl):
+    if g.POLYMUL == "kronecker":
+        ap = kron_pack(a.coeffs)
+        for i in range(g.L):
+            set_coeffs(r.vec[i].coeffs, kron_unpack(ap*kron_pack(v.vec[i].coeffs)))
+        return
+    if g.POLYMUL == "fft":
+        t = fft_mul(a.coeffs, [v.vec[i].coeffs for i in range(g.L)])
+        for i in range(g.L):
+            set_coeffs(r.vec[i].coeffs, t[i])
+        return
+
     for i in range(g.L):
         poly_pointwise_montgomery(r.vec[i], a, v.vec[i])
 
@@ -123,12 +301,32 @@ def polyvecl_pointwise_poly_montgomery(r:polyvecl, a:poly, v:polyvecl):
 # Description: Pointwise multiply vectors of polynomials of length L, multiply
 #              resulting vector by 2^{-32} and add (accumulate) polynomials
 #              in it. Input/output vectors are in NTT domain representation.
+#              With plain arithmetic the products are accumulated first and
+#              reduced mod Q once. With a coefficient domain engine in
+#              g.POLYMUL this is the sum of the negacyclic products.
 #
 # Arguments:   - poly w: output polynomial
 #              - polyvecl u: first input vector
 #              - polyvecl v: second input vector
 ##################################################
 def polyvecl_pointwise_acc_montgomery(w:poly, u:polyvecl, v:polyvecl):
+    if g.POLYMUL == "kronecker":
+        set_coeffs(w.coeffs, kron_mul_acc([u.vec[i].coeffs for i in range(g.L)],
+                                          [kron_pack(v.vec[i].coeffs) for i in range(g.L)]))
+        return
+    if g.POLYMUL == "fft":
+        set_coeffs(w.coeffs, fft_mul([u.vec[i].coeffs for i in range(g.L)],
+                                     [v.vec[i].coeffs for i in range(g.L)], acc=True))
+        return
+
+    if g.ARITH == "plain":
+        acc = [0]*g.N
+        for i in range(g.L):
+            acc = [s + x*y for s, x, y in zip(acc, u.vec[i].coeffs, v.vec[i].coeffs)]
+        Q = g.Q
+        set_coeffs(w.coeffs, [s % Q for s in acc])
+        return
+
     t = poly()
     poly_pointwise_montgomery(w, u.vec[0], v.vec[0])
     for i in range(1, g.L):
@@ -136,6 +334,26 @@ def polyvecl_pointwise_acc_montgomery(w:poly, u:polyvecl, v:polyvecl):
         poly_add(w, w, t)
 
 
+#################################################
+# Name:        polyvecl_challenge_mul
+#
+# Description: Multiply vector of polynomials of Length L by a sparse
+#              challenge, see poly_challenge_mul(). Input/output vectors are
+#              in coefficient representation.
+#
+# Arguments:   - polyvecl r: output vector
+#              - List[tuple[int, int]] c: sparse challenge
+#              - polyvecl v: input vector
+##################################################
+def polyvecl_challenge_mul(r:polyvecl, c:List[tuple[int, int]], v:polyvecl):
+    if g.KERNELS == "numpy":
+        polys_from_array(r.vec, challenge_mul_array(c, polys_to_array(v.vec)))
+        return
+
+    for i in range(g.L):
+        poly_challenge_mul(r.vec[i], c, v.vec[i])
+
+
 #################################################
 # Name:        polyvecl_chknorm
 #
@@ -149,6 +367,9 @@ def polyvecl_pointwise_acc_montgomery(w:poly, u:polyvecl, v:polyvecl):
 # and 1 otherwise.
 ##################################################
 def polyvecl_chknorm(v:polyvecl, bound:int) -> int:
+    if g.KERNELS == "numpy":
+        return chknorm_array(polys_to_array(v.vec), bound)
+
     for i in range(g.L):
         if poly_chknorm(v.vec[i], bound):
             return 1
@@ -176,6 +397,10 @@ def polyveck_uniform_eta(v:polyveck, seed:List[int], nonce:int):
 # Arguments:   - polyveck v: input/output vector
 ##################################################
 def polyveck_reduce(v:polyveck):
+    if g.KERNELS == "numpy":
+        polys_from_array(v.vec, reduce32_array(polys_to_array(v.vec)))
+        return
+
     for i in range(g.K):
         poly_reduce(v.vec[i])
 
@@ -189,6 +414,10 @@ def polyveck_reduce(v:polyveck):
 # Arguments:   - polyveck v: input/output vector
 ##################################################
 def polyveck_caddq(v:polyveck):
+    if g.KERNELS == "numpy":
+        polys_from_array(v.vec, caddq_array(polys_to_array(v.vec)))
+        return
+
     for i in range(g.K):
         poly_caddq(v.vec[i])
 
@@ -233,6 +462,10 @@ def polyveck_sub(w:polyveck, u:polyveck, v:polyveck):
 # Arguments:   - polyveck v: input/output vector
 ##################################################
 def polyveck_shiftl(v:polyveck):
+    if g.KERNELS == "numpy":
+        polys_from_array(v.vec, polys_to_array(v.vec) << g.D)
+        return
+
     for i in range(g.K):
         poly_shiftl(v.vec[i])
 
@@ -246,8 +479,7 @@ def polyveck_shiftl(v:polyveck):
 # Arguments:   - polyveck v: input/output vector
 ##################################################
 def polyveck_ntt(v:polyveck):
-    for i in range(g.K):
-        poly_ntt(v.vec[i])
+    ntt_batch([v.vec[i].coeffs for i in range(g.K)])
 
 
 #################################################
@@ -260,15 +492,45 @@ def polyveck_ntt(v:polyveck):
 # Arguments:   - polyveck v: input/output vector
 ##################################################
 def polyveck_invntt_tomont(v:polyveck):
-    for i in range(g.K):
-        poly_invntt_tomont(v.vec[i])
+    invntt_tomont_batch([v.vec[i].coeffs for i in range(g.K)])
 
 
 def polyveck_pointwise_poly_montgomery(r:polyveck, a:poly, v:polyveck):
+    if g.POLYMUL == "kronecker":
+        ap = kron_pack(a.coeffs)
+        for i in range(g.K):
+            set_coeffs(r.vec[i].coeffs, kron_unpack(ap*kron_pack(v.vec[i].coeffs)))
+        return
+    if g.POLYMUL == "fft":
+        t = fft_mul(a.coeffs, [v.vec[i].coeffs for i in range(g.K)])
+        for i in range(g.K):
+            set_coeffs(r.vec[i].coeffs, t[i])
+        return
+
     for i in range(g.K):
         poly_pointwise_montgomery(r.vec[i], a, v.vec[i])
 
 
+#################################################
+# Name:        polyveck_challenge_mul
+#
+# Description: Multiply vector of polynomials of Length K by a sparse
+#              challenge, see poly_challenge_mul(). Input/output vectors are
+#              in coefficient representation.
+#
+# Arguments:   - polyveck r: output vector
+#              - List[tuple[int, int]] c: sparse challenge
+#              - polyveck v: input vector
+##################################################
+def polyveck_challenge_mul(r:polyveck, c:List[tuple[int, int]], v:polyveck):
+    if g.KERNELS == "numpy":
+        polys_from_array(r.vec, challenge_mul_array(c, polys_to_array(v.vec)))
+        return
+
+    for i in range(g.K):
+        poly_challenge_mul(r.vec[i], c, v.vec[i])
+
+
 #################################################
 # Name:        polyveck_chknorm
 #
@@ -282,6 +544,9 @@ def polyveck_pointwise_poly_montgomery(r:polyveck, a:poly, v:polyveck):
 # and 1 otherwise.
 ##################################################
 def polyveck_chknorm(v:polyveck, bound:int) -> int:
+    if g.KERNELS == "numpy":
+        return chknorm_array(polys_to_array(v.vec), bound)
+
     for i in range(g.K):
         if poly_chknorm(v.vec[i], bound):
             return 1
@@ -304,6 +569,12 @@ def polyveck_chknorm(v:polyveck, bound:int) -> int:
 #              - polyveck v: input vector
 ##################################################
 def polyveck_power2round(v1:polyveck, v0:polyveck, v:polyveck):
+    if g.KERNELS == "numpy":
+        r0, r1 = power2round_array(polys_to_array(v.vec))
+        polys_from_array(v0.vec, r0)
+        polys_from_array(v1.vec, r1)
+        return
+
     for i in range(g.K):
         poly_power2round(v1.vec[i], v0.vec[i], v.vec[i])
 
@@ -324,10 +595,52 @@ def polyveck_power2round(v1:polyveck, v0:polyveck, v:polyveck):
 #              - polyveck v: input vector
 ##################################################
 def polyveck_decompose(v1:polyveck, v0:polyveck, v:polyveck):
+    if g.KERNELS == "numpy":
+        r0, r1 = decompose_array(polys_to_array(v.vec))
+        polys_from_array(v0.vec, r0)
+        polys_from_array(v1.vec, r1)
+        return
+
     for i in range(g.K):
         poly_decompose(v1.vec[i], v0.vec[i], v.vec[i])
 
 
+#################################################
+# Name:        polyveck_highbits
+#
+# Description: High bits of polyveck_decompose alone.
+#
+# Arguments:   - polyveck v1: output vector with coefficients a1
+#              - polyveck v: input vector
+##################################################
+def polyveck_highbits(v1:polyveck, v:polyveck):
+    if g.KERNELS == "numpy":
+        polys_from_array(v1.vec, highbits_array(polys_to_array(v.vec)))
+        return
+
+    for i in range(g.K):
+        poly_highbits(v1.vec[i], v.vec[i])
+
+
+#################################################
+# Name:        polyveck_lowbits
+#
+# Description: Low bits of polyveck_decompose from the vector and its high
+#              bits.
+#
+# Arguments:   - polyveck v0: output vector with coefficients a0
+#              - polyveck v: input vector
+#              - polyveck v1: high bits of v
+##################################################
+def polyveck_lowbits(v0:polyveck, v:polyveck, v1:polyveck):
+    if g.KERNELS == "numpy":
+        polys_from_array(v0.vec, lowbits_array(polys_to_array(v.vec), polys_to_array(v1.vec)))
+        return
+
+    for i in range(g.K):
+        poly_lowbits(v0.vec[i], v.vec[i], v1.vec[i])
+
+
 #################################################
 # Name:        polyveck_make_hint
 #
@@ -340,6 +653,11 @@ def polyveck_decompose(v1:polyveck, v0:polyveck, v:polyveck):
 # Returns number of 1 bits.
 ##################################################
 def polyveck_make_hint(h:polyveck, v0:polyveck, v1:polyveck):
+    if g.KERNELS == "numpy":
+        r = make_hint_array(polys_to_array(v0.vec), polys_to_array(v1.vec))
+        polys_from_array(h.vec, r)
+        return int(r.sum())
+
     s = 0
     for i in range(g.K):
         s += poly_make_hint(h.vec[i], v0.vec[i], v1.vec[i])
@@ -358,13 +676,13 @@ def polyveck_make_hint(h:polyveck, v0:polyveck, v1:polyveck):
 #              - polyveck *h: input hint vector
 ##################################################
 def polyveck_use_hint(w:polyveck, u:polyveck, h:polyveck):
+    if g.KERNELS == "numpy":
+        polys_from_array(w.vec, use_hint_array(polys_to_array(u.vec), polys_to_array(h.vec)))
+        return
+
     for i in range(g.K):
         poly_use_hint(w.vec[i], u.vec[i], h.vec[i])
 
 
 def polyveck_pack_w1(r:List[int], w1:polyveck):
-    for i in range(g.K):
-        temp = [0]*g.POLYW1_PACKEDBYTES
-        polyw1_pack(temp, w1.vec[i])
-        for j in range(g.POLYW1_PACKEDBYTES):
-            r[i*g.POLYW1_PACKEDBYTES+j] = temp[j]
+    pack_polys(r, 0, w1.vec, "w1")
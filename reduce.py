@@ -2,6 +2,11 @@
 
 from params import *
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 MONT = -4186625 # 2^32 % Q
 QINV = 58728449 # q^(-1) mod 2^32
 
@@ -25,6 +30,26 @@ def montgomery_reduce(a:int) -> int:
     return t
 
 
+##################################################
+# Name:        montgomery_reduce_array
+#
+# Description: Array version of montgomery_reduce. Reduces every element of
+#              an int64 array at once and gives exactly the same
+#              representatives as the scalar function.
+#
+# Arguments:   - np.ndarray a: int64 array of finite field elements
+#
+# Returns array r.
+##################################################
+def montgomery_reduce_array(a):
+    # int64 wraps modulo 2^64, so the low 32 bits are still exact
+    t = (a*QINV) & 0xFFFFFFFF
+    t = (a - t*g.Q) >> 32
+    t += g.Q
+    t -= (t > (g.Q>>1))*g.Q
+    return t
+
+
 ##################################################
 # Name:        reduce32
 #
@@ -41,6 +66,21 @@ def reduce32(a:int) -> int:
     return t
 
 
+##################################################
+# Name:        reduce32_array
+#
+# Description: Array version of reduce32. Gives exactly the same
+#              representatives for every element.
+#
+# Arguments:   - np.ndarray a: int64 array of finite field elements
+#
+# Returns array r.
+##################################################
+def reduce32_array(a):
+    t = (a + (1 << 22)) >> 23
+    return a - t*g.Q
+
+
 ##################################################
 # Name:        caddq
 #
@@ -55,6 +95,19 @@ def caddq(a:int) -> int:
     return a
 
 
+##################################################
+# Name:        caddq_array
+#
+# Description: Array version of caddq.
+#
+# Arguments:   - np.ndarray a: int64 array of finite field elements
+#
+# Returns array r.
+##################################################
+def caddq_array(a):
+    return a + ((a >> 31) & g.Q)
+
+
 ##################################################
 # Name:        freeze
 #
@@ -69,3 +122,16 @@ def freeze(a:int) -> int:
     a = reduce32(a)
     a = caddq(a)
     return a
+
+
+##################################################
+# Name:        freeze_array
+#
+# Description: Array version of freeze.
+#
+# Arguments:   - np.ndarray a: int64 array of finite field elements
+#
+# Returns array r.
+##################################################
+def freeze_array(a):
+    return caddq_array(reduce32_array(a))
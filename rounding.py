@@ -1,6 +1,14 @@
 # Contains elements from rounding.h and rouding.c
 
 from params import *
+import mmap
+import os
+import tempfile
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 #################################################
 # Name:        power2round
@@ -33,19 +41,51 @@ def power2round(a: int) -> tuple[int, int]:
 # Returns a0, a1.
 #################################################
 def decompose(a: int) -> tuple[int, int]:
-    a1 = (a+127) >> 7;
+    a1 = highbits(a)
+    a0 = a - a1*2*g.GAMMA2;
+    a0 -= (((g.Q-1)//2 - a0) >> 31) & g.Q
+
+    return a0, a1
+
+
+#################################################
+# Name:        highbits
+#
+# Description: High bits a1 of decompose, without the low bits. Assumes a to
+#              be standard representative.
+#
+# Arguments:   - int32_t a: input element
+#
+# Returns a1.
+#################################################
+def highbits(a: int) -> int:
+    if g.ROUNDING == "tables":
+        return rounding_table()[0][a]
 
+    a1 = (a+127) >> 7;
     if g.GAMMA2 == (g.Q-1)/32:
         a1 = (a1*1025 + (1 << 21)) >> 22
         a1 &= 15
     elif g.GAMMA2 == (g.Q-1)/88:
         a1  = (a1*11275 + (1 << 23)) >> 24
         a1 ^= ((43 - a1) >> 31) & a1
+    return a1
 
-    a0 = a - a1*2*g.GAMMA2;
-    a0 -= (((g.Q-1)//2 - a0) >> 31) & g.Q
 
-    return a0, a1
+#################################################
+# Name:        lowbits
+#
+# Description: Low bits a0 of decompose from a and its high bits a1.
+#
+# Arguments:   - int32_t a: input element
+#              - int32_t a1: high bits of a
+#
+# Returns a0.
+#################################################
+def lowbits(a: int, a1: int) -> int:
+    a0 = a - a1*2*g.GAMMA2
+    a0 -= (((g.Q-1)//2 - a0) >> 31) & g.Q
+    return a0
 
 
 #################################################
@@ -76,6 +116,9 @@ def make_hint(a0: int, a1: int) -> bool:
 # Returns corrected high bits.
 #################################################
 def use_hint(a: int, hint: int) -> int:
+    if g.ROUNDING == "tables":
+        return rounding_table()[0][hint*g.Q + a]
+
     a0, a1 = decompose(a)
 
     if hint == 0:
@@ -97,3 +140,188 @@ def use_hint(a: int, hint: int) -> int:
                 return 43
             else:
                 return a1 - 1
+
+
+
+#################################################
+# Name:        power2round_array
+#
+# Description: Array version of power2round.
+#
+# Arguments:   - np.ndarray a: int64 array of standard representatives
+#
+# Returns arrays a0, a1.
+#################################################
+def power2round_array(a):
+    a1 = (a + (1 << (g.D-1)) - 1) >> g.D
+    a0 = a - (a1 << g.D)
+    return a0, a1
+
+
+# Array versions of decompose and use_hint for the two values of GAMMA2. The
+# variant is picked once per call, so there is no branch per element.
+def _decompose_array_32(a):
+    a1 = (a + 127) >> 7
+    a1 = (a1*1025 + (1 << 21)) >> 22
+    a1 &= 15
+    return a1
+
+
+def _decompose_array_88(a):
+    a1 = (a + 127) >> 7
+    a1 = (a1*11275 + (1 << 23)) >> 24
+    a1 ^= ((43 - a1) >> 31) & a1
+    return a1
+
+
+def _use_hint_array_32(a0, a1, hint):
+    return np.where(hint == 0, a1, (a1 + np.where(a0 > 0, 1, -1)) & 15)
+
+
+def _use_hint_array_88(a0, a1, hint):
+    up = np.where(a1 == 43, 0, a1 + 1)
+    down = np.where(a1 == 0, 43, a1 - 1)
+    return np.where(hint == 0, a1, np.where(a0 > 0, up, down))
+
+
+_decompose_arrays = {(Parameters.Q-1)//32: _decompose_array_32, (Parameters.Q-1)//88: _decompose_array_88}
+_use_hint_arrays = {(Parameters.Q-1)//32: _use_hint_array_32, (Parameters.Q-1)//88: _use_hint_array_88}
+
+
+#################################################
+# Name:        decompose_array
+#
+# Description: Array version of decompose.
+#
+# Arguments:   - np.ndarray a: int64 array of standard representatives
+#
+# Returns arrays a0, a1.
+#################################################
+def decompose_array(a):
+    a1 = highbits_array(a)
+    return lowbits_array(a, a1), a1
+
+
+# Array versions of highbits and lowbits
+def highbits_array(a):
+    if g.ROUNDING == "tables":
+        return rounding_table()[1][a].astype(np.int64)
+    return _decompose_arrays[g.GAMMA2](a)
+
+
+def lowbits_array(a, a1):
+    a0 = a - a1*2*g.GAMMA2
+    a0 -= (((g.Q-1)//2 - a0) >> 31) & g.Q
+    return a0
+
+
+#################################################
+# Name:        make_hint_array
+#
+# Description: Array version of make_hint.
+#
+# Arguments:   - np.ndarray a0: low bits of input elements
+#              - np.ndarray a1: high bits of input elements
+#
+# Returns int64 array with 1 where there is an overflow and 0 elsewhere.
+#################################################
+def make_hint_array(a0, a1):
+    h = (a0 > g.GAMMA2) | (a0 < -g.GAMMA2) | ((a0 == -g.GAMMA2) & (a1 != 0))
+    return h.astype(np.int64)
+
+
+#################################################
+# Name:        use_hint_array
+#
+# Description: Array version of use_hint.
+#
+# Arguments:   - np.ndarray a: int64 array of input elements
+#              - np.ndarray hint: hint bits
+#
+# Returns array of corrected high bits.
+#################################################
+def use_hint_array(a, hint):
+    if g.ROUNDING == "tables":
+        return rounding_table()[1][hint*g.Q + a].astype(np.int64)
+
+    a0, a1 = decompose_array(a)
+    return _use_hint_arrays[g.GAMMA2](a0, a1, hint)
+
+
+# Table-driven rounding. For each GAMMA2 one file of 2*Q bytes holds the high
+# bits of every a in [0, Q) followed by use_hint(a, 1), so entry hint*Q + a is
+# use_hint(a, hint) and the first half doubles as the decompose table. The
+# files are memory-mapped read-only, which lets every process on a machine
+# share one page-cache copy.
+_rounding_tables = {}
+# The scalar functions look the table up once per coefficient, so the table
+# of the last (directory, GAMMA2) is kept apart from the path resolution.
+_rounding_table_last = (None, None)
+
+
+def _rounding_table_build() -> bytes:
+    if np is not None:
+        a = np.arange(g.Q, dtype=np.int64)
+        a1 = _decompose_arrays[g.GAMMA2](a)
+        a0 = a - a1*2*g.GAMMA2
+        a0 -= (((g.Q-1)//2 - a0) >> 31) & g.Q
+        h = _use_hint_arrays[g.GAMMA2](a0, a1, 1)
+        return np.concatenate((a1, h)).astype(np.uint8).tobytes()
+
+    # Without numpy the scalar functions produce the entries.
+    rounding, g.ROUNDING = g.ROUNDING, "arith"
+    try:
+        return bytes(decompose(a)[1] for a in range(g.Q)) + bytes(use_hint(a, 1) for a in range(g.Q))
+    finally:
+        g.ROUNDING = rounding
+
+
+# Default directory of the table files: a per-user cache, as the package
+# itself may be installed read-only
+def rounding_table_dir() -> str:
+    if g.ROUNDING_TABLE_DIR is not None:
+        return g.ROUNDING_TABLE_DIR
+    cache = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache, "dilithium")
+
+
+#################################################
+# Name:        rounding_table
+#
+# Description: Returns the rounding table for the current GAMMA2. On first use
+#              the file is created in rounding_table_dir(), which is
+#              g.ROUNDING_TABLE_DIR or by default $XDG_CACHE_HOME/dilithium
+#              (~/.cache/dilithium), unless it already exists. The file is
+#              written under a temporary name and renamed, so concurrent
+#              processes never map a partial table.
+#
+# Returns tuple (mmap, np.ndarray) of the same bytes; the array is None
+# without numpy.
+#################################################
+def rounding_table():
+    global _rounding_table_last
+    key = (g.ROUNDING_TABLE_DIR, g.GAMMA2)
+    if _rounding_table_last[0] == key:
+        return _rounding_table_last[1]
+
+    d = rounding_table_dir()
+    path = os.path.join(d, "rounding_%d.bin" % g.GAMMA2)
+    t = _rounding_tables.get(path)
+    if t is None:
+        if not os.path.exists(path) or os.path.getsize(path) != 2*g.Q:
+            os.makedirs(d, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=d)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(_rounding_table_build())
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+        with open(path, "rb") as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        t = (m, None if np is None else np.frombuffer(m, dtype=np.uint8))
+        _rounding_tables[path] = t
+    _rounding_table_last = (key, t)
+    return t
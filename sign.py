@@ -3,7 +3,10 @@ from params import *
 from packing import *
 from polyvec import *
 from poly import *
-from os import urandom
+from os import urandom, getpid
+from concurrent.futures import ProcessPoolExecutor
+import queue
+import threading
 from symmetric import *
 from fips202 import *
 
@@ -19,13 +22,14 @@ from fips202 import *
 #                              of CRYPTO_SECRETKEYBYTES bytes)
 #              - bytes det:    optional seed for testing, uses system
 #                              randomness if not provided
+#              - bool stream:  expand A row by row while multiplying
+#                              instead of holding it, see matrix_stream
 #
 # Returns 0 (success)
 ##################################################
-def crypto_sign_keypair(pk:List[int], sk:List[int], det:bytes=None) -> int:
+def crypto_sign_keypair(pk:List[int], sk:List[int], det:bytes=None, stream:bool=False) -> int:
     # seedbuf = [0]*(2*SEEDBYTES+CRHBYTES)
     # tr = [0]*SEEDBYTES
-    mat = [polyvecl() for _ in range(g.K)]
     s1 = polyvecl()
     s1hat = polyvecl()
     s2 = polyveck()
@@ -42,7 +46,7 @@ def crypto_sign_keypair(pk:List[int], sk:List[int], det:bytes=None) -> int:
     key = list(seedbuf[-g.SEEDBYTES:])
 
     # Expand matrix
-    polyvec_matrix_expand(mat, rho)
+    mat = polyvec_matrix(rho, stream)
 
     # Sample short vectors s1 and s2
     polyvecl_uniform_eta(s1, rhoprime, 0)
@@ -60,7 +64,10 @@ def crypto_sign_keypair(pk:List[int], sk:List[int], det:bytes=None) -> int:
     # Add error vector s2
     polyveck_add(t1, t1, s2)
 
-    # Extract t1 and write public key
+    # Extract t1 and write public key. If the inverse NTT gave standard
+    # representatives, t1 can exceed Q-1, so reduce it first.
+    if invntt_standard(g.K):
+        polyveck_reduce(t1)
     polyveck_caddq(t1)
     polyveck_power2round(t1, t0, t1)
     pack_pk(pk, rho, t1)
@@ -72,6 +79,323 @@ def crypto_sign_keypair(pk:List[int], sk:List[int], det:bytes=None) -> int:
     return 0
 
 
+# Settings that determine the content of a prepared key. The challenge
+# engine only matters for secret keys.
+def _prepared_settings(challenge: bool = True) -> tuple:
+    return (g.K, g.L, g.POLYMUL, g.ARITH) + ((g.CHALLENGE,) if challenge else ())
+
+
+#################################################
+# Name:        PreparedSecretKey
+#
+# Description: Secret key unpacked once for repeated signing: rho, tr and
+#              key, the expanded matrix A and s1, s2, t0 transformed as
+#              crypto_sign_signature needs them. Signing only reads it, so
+#              one object can be shared by any number of threads. It is
+#              bound to the mode and the g.POLYMUL, g.ARITH and g.CHALLENGE
+#              settings it was prepared with.
+#
+# Arguments:   - List[int] sk: bit-packed secret key
+#              - bool stream:  keep A as a matrix_stream, which takes one
+#                              row of memory but is expanded again for
+#                              every signing attempt
+##################################################
+class PreparedSecretKey:
+    __slots__ = ("packed", "rho", "tr", "key", "mat", "s1", "s2", "t0", "settings")
+
+    def __init__(self, sk: List[int], stream: bool = False):
+        rho, tr, key = ([0]*g.SEEDBYTES for _ in range(3))
+        s1 = polyvecl()
+        s2 = polyveck()
+        t0 = polyveck()
+        unpack_sk(rho, tr, key, t0, s1, s2, sk)
+
+        # Expand matrix and transform vectors
+        mat = polyvec_matrix(rho, stream)
+        if g.CHALLENGE != "sparse":
+            polyvecl_ntt(s1)
+            polyveck_ntt(s2)
+            polyveck_ntt(t0)
+        if np is not None and isinstance(mat, np.ndarray):
+            mat.flags.writeable = False
+
+        self.packed = bytes(sk)
+        self.rho, self.tr, self.key = bytes(rho), bytes(tr), bytes(key)
+        self.mat, self.s1, self.s2, self.t0 = mat, s1, s2, t0
+        self.settings = _prepared_settings()
+
+
+#################################################
+# Name:        signature_scratch
+#
+# Description: Buffers of the signing attempts of one signature. The
+#              rejection loop passes the same scratch to every attempt, so
+#              they are allocated once per signature. Every attempt
+#              overwrites them, a commitment made with a scratch is only
+#              valid until the next one.
+##################################################
+class signature_scratch:
+    __slots__ = ("y", "z", "w", "w1", "w0", "h", "cp", "buf")
+
+    def __init__(self):
+        self.y = polyvecl()
+        self.z = polyvecl()
+        self.w = polyveck()
+        self.w1 = polyveck()
+        self.w0 = polyveck()
+        self.h = polyveck()
+        self.cp = poly()
+        self.buf = [0]*(g.K*g.POLYW1_PACKEDBYTES)
+
+
+#################################################
+# Name:        signature_commit
+#
+# Description: Commitment of one signing attempt, which does not depend on
+#              the message: sample y, compute w = A*y and pack its high bits
+#              w1. This is the expensive part of an attempt. The low bits
+#              are left to signature_respond, which only needs them once z
+#              passes its check.
+#
+# Arguments:   - PreparedSecretKey sk: prepared secret key
+#              - List[int] rhoprime:   seed of y
+#              - int nonce:            nonce of y
+#              - signature_scratch scratch: buffers to reuse, or None for
+#                                      new ones
+#
+# Returns tuple (y, w, w1, packed w1).
+##################################################
+def signature_commit(sk: PreparedSecretKey, rhoprime: List[int], nonce: int,
+                     scratch: signature_scratch = None) -> tuple:
+    if scratch is None:
+        scratch = signature_scratch()
+    y, z, w, w1, buf = scratch.y, scratch.z, scratch.w, scratch.w1, scratch.buf
+
+    # Sample intermediate vector y
+    polyvecl_uniform_gamma1(y, rhoprime, nonce)
+
+    # Matrix-vector multiplication
+    for i in range(g.L):
+        for j in range(g.N):
+            z.vec[i].coeffs[j] = y.vec[i].coeffs[j]
+    polyvecl_ntt(z)
+    polyvec_matrix_pointwise_montgomery(w, sk.mat, z)
+    polyveck_reduce(w)
+    polyveck_invntt_tomont(w)
+
+    # Compute and pack the high bits w1
+    polyveck_caddq(w)
+    polyveck_highbits(w1, w)
+    polyveck_pack_w1(buf, w1)
+    return y, w, w1, buf
+
+
+# c*a for one polynomial in coefficient representation, from the sparse
+# challenge cs or else the NTT of c in cp
+def _challenge_mul(r: poly, cp: poly, cs, a: poly):
+    if cs is not None:
+        poly_challenge_mul(r, cs, a)
+    else:
+        poly_pointwise_montgomery(r, cp, a)
+        poly_invntt_tomont(r)
+
+
+# Rejection checks of the scalar kernels, one polynomial at a time. Returns 1
+# at the first polynomial that fails, 0 if z and h are complete.
+def _respond_polys(z: polyvecl, h: polyveck, w0: polyveck, cp: poly, cs, sk: PreparedSecretKey,
+                   y: polyvecl, w: polyveck, w1: polyveck) -> int:
+    # Compute z, reject if it reveals secret
+    for i in range(g.L):
+        _challenge_mul(z.vec[i], cp, cs, sk.s1.vec[i])
+        poly_add(z.vec[i], z.vec[i], y.vec[i])
+        poly_reduce(z.vec[i])
+        if poly_chknorm(z.vec[i], g.GAMMA1 - g.BETA):
+            return 1
+
+    # Check that subtracting cs2 does not change high bits of w and low bits
+    # do not reveal secret information
+    for i in range(g.K):
+        _challenge_mul(h.vec[i], cp, cs, sk.s2.vec[i])
+        poly_lowbits(w0.vec[i], w.vec[i], w1.vec[i])
+        poly_sub(w0.vec[i], w0.vec[i], h.vec[i])
+        poly_reduce(w0.vec[i])
+        if poly_chknorm(w0.vec[i], g.GAMMA2 - g.BETA):
+            return 1
+
+    # Compute hints for w1, reject as soon as ct0 is too large or there are
+    # too many hints
+    n = 0
+    for i in range(g.K):
+        _challenge_mul(h.vec[i], cp, cs, sk.t0.vec[i])
+        poly_reduce(h.vec[i])
+        if poly_chknorm(h.vec[i], g.GAMMA2):
+            return 1
+        poly_add(w0.vec[i], w0.vec[i], h.vec[i])
+        n += poly_make_hint(h.vec[i], w0.vec[i], w1.vec[i])
+        if n > g.OMEGA:
+            return 1
+    return 0
+
+
+# Rejection checks of the array kernels, whose cost is mostly per call, so
+# they check whole vectors. Returns 1 if a check fails.
+def _respond_vectors(z: polyvecl, h: polyveck, w0: polyveck, cp: poly, cs, sk: PreparedSecretKey,
+                     y: polyvecl, w: polyveck, w1: polyveck) -> int:
+    # Compute z, reject if it reveals secret
+    if cs is not None:
+        polyvecl_challenge_mul(z, cs, sk.s1)
+    else:
+        polyvecl_pointwise_poly_montgomery(z, cp, sk.s1)
+        polyvecl_invntt_tomont(z)
+    polyvecl_add(z, z, y)
+    polyvecl_reduce(z)
+    if polyvecl_chknorm(z, g.GAMMA1-g.BETA):
+        return 1
+
+    # Check that subtracting cs2 does not change high bits of w and low bits
+    # do not reveal secret information
+    if cs is not None:
+        polyveck_challenge_mul(h, cs, sk.s2)
+    else:
+        polyveck_pointwise_poly_montgomery(h, cp, sk.s2)
+        polyveck_invntt_tomont(h)
+    polyveck_lowbits(w0, w, w1)
+    polyveck_sub(w0, w0, h)
+    polyveck_reduce(w0)
+    if polyveck_chknorm(w0, g.GAMMA2 - g.BETA):
+        return 1
+
+    # Compute hints for w1
+    if cs is not None:
+        polyveck_challenge_mul(h, cs, sk.t0)
+    else:
+        polyveck_pointwise_poly_montgomery(h, cp, sk.t0)
+        polyveck_invntt_tomont(h)
+    polyveck_reduce(h)
+    if polyveck_chknorm(h, g.GAMMA2):
+        return 1
+
+    polyveck_add(w0, w0, h)
+    n = polyveck_make_hint(h, w0, w1)
+    if n > g.OMEGA:
+        return 1
+    return 0
+
+
+#################################################
+# Name:        signature_respond
+#
+# Description: Finish a signing attempt for the message: derive the
+#              challenge c from mu and the packed w1, compute z and the
+#              hint and run the rejection checks. The checks run from the
+#              cheapest on and stop at the first that fails, the products
+#              with t0 and the low bits of w are only computed when they
+#              are needed. With the scalar kernels this goes one polynomial
+#              at a time, so most rejected attempts stop early. The
+#              commitment is consumed.
+#
+# Arguments:   - List[int] sig:        output signature
+#              - PreparedSecretKey sk: prepared secret key
+#              - List[int] mu:         CRH(tr, msg)
+#              - tuple commitment:     output of signature_commit
+#              - signature_scratch scratch: buffers to reuse, or None for
+#                                      new ones
+#
+# Returns 1 if the signature was written, 0 if the attempt was rejected
+##################################################
+def signature_respond(sig: List[int], sk: PreparedSecretKey, mu: List[int], commitment: tuple,
+                      scratch: signature_scratch = None) -> int:
+    y, w, w1, buf = commitment
+    if scratch is None:
+        scratch = signature_scratch()
+    z, h, w0, cp = scratch.z, scratch.h, scratch.w0, scratch.cp
+
+    # Call the random oracle
+    state = stream256_state()
+    state.update(bytes(mu))
+    state.update(bytes(buf))
+    sig[:g.SEEDBYTES] = state.read(g.SEEDBYTES)
+    poly_challenge(cp, sig[:g.SEEDBYTES])
+    cs = None
+    if g.CHALLENGE == "sparse":
+        # The products with c are exact, small and computed without NTT
+        cs = challenge_sparse(cp)
+    else:
+        poly_ntt(cp)
+
+    respond = _respond_vectors if g.KERNELS == "numpy" else _respond_polys
+    if respond(z, h, w0, cp, cs, sk, y, w, w1):
+        return 0
+
+    # Write signature
+    pack_sig(sig, sig, z, h)
+    return 1
+
+
+# Prepared keys of the worker processes running _sign_attempt
+_attempt_keys = {}
+
+
+# One signing attempt in a worker. Workers in the process of the caller share
+# its settings and prepared key. Workers in other processes take the mode and
+# engines of the caller, and prepare a packed key once per process.
+def _sign_attempt(pid: int, state: tuple, sk, mu: List[int], rhoprime: List[int], nonce: int):
+    if getpid() != pid:
+        g.restore(state)
+        if not isinstance(sk, PreparedSecretKey):
+            if (state, sk) not in _attempt_keys:
+                if len(_attempt_keys) >= 8:
+                    _attempt_keys.clear()
+                _attempt_keys[state, sk] = PreparedSecretKey(sk)
+            sk = _attempt_keys[state, sk]
+    sig = [0]*g.CRYPTO_BYTES
+    if signature_respond(sig, sk, mu, signature_commit(sk, rhoprime, nonce)):
+        return bytes(sig)
+    return None
+
+
+#################################################
+# Name:        sign_speculative
+#
+# Description: Run the attempts of the deterministic rejection loop
+#              concurrently. Attempts with the next nonces are kept in
+#              flight on the executor and their results are taken in nonce
+#              order, so the first accepted one is the attempt the
+#              sequential loop would accept and the signature is the same.
+#              Attempts that have not started when it is found are
+#              cancelled; running ones finish and are dropped.
+#
+# Arguments:   - List[int] sig:        output signature
+#              - PreparedSecretKey sk: prepared secret key
+#              - List[int] mu:         CRH(tr, msg)
+#              - List[int] rhoprime:   seed of y
+#              - executor:             concurrent.futures executor; a
+#                                      ProcessPoolExecutor is sent the packed
+#                                      key, any other the prepared key
+#              - int attempts:         number of attempts in flight
+##################################################
+def sign_speculative(sig: List[int], sk: PreparedSecretKey, mu: List[int], rhoprime: List[int], executor, attempts: int):
+    if attempts < 1:
+        raise ValueError("At least one attempt has to be in flight")
+    key = sk.packed if isinstance(executor, ProcessPoolExecutor) else sk
+    job = (getpid(), g.snapshot(), key, mu, rhoprime)
+    pending = {}
+    nonce = 0
+    try:
+        while True:
+            for n in range(nonce, nonce + attempts):
+                if n not in pending:
+                    pending[n] = executor.submit(_sign_attempt, *job, n)
+            r = pending.pop(nonce).result()
+            if r is not None:
+                sig[:g.CRYPTO_BYTES] = r
+                return
+            nonce += 1
+    finally:
+        for f in pending.values():
+            f.cancel()
+
+
 #################################################
 # Name:        crypto_sign_signature
 #
@@ -81,106 +405,54 @@ def crypto_sign_keypair(pk:List[int], sk:List[int], det:bytes=None) -> int:
 #              - int siglen:      output length of signature (UNUSED)
 #              - List[int] m:     message to be signed
 #              - int mlen:        length of message (UNUSED)
-#              - List[int] sk:    bit-packed secret key
+#              - sk:              bit-packed secret key, PreparedSecretKey or
+#                                 CommitmentPool; a prepared key skips
+#                                 unpacking, matrix expansion and the NTTs
+#                                 of s1, s2 and t0, a pool signs randomized
+#                                 with precomputed commitments
+#              - bool stream:     expand A row by row in every attempt
+#                                 instead of holding it; a prepared key
+#                                 keeps the choice it was prepared with
+#              - executor:        optional concurrent.futures executor to
+#                                 run attempts speculatively in parallel,
+#                                 see sign_speculative
+#              - int attempts:    number of attempts in flight on executor
 #
 # Returns 0 (success)
 ##################################################
-def crypto_sign_signature(sig:List[int], siglen:int, m:List[int], mlen:int, sk:List[int]) -> int:
-    # seedbuf = [0]*(3*SEEDBYTES + 2*CRHBYTES)
-    rho, tr, key = ([0]*g.SEEDBYTES for _ in range(3))
-    # mu, rhoprime = ([0]*CRHBYTES for _ in range(2))
-
-    nonce = 0
-    mat = [polyvecl() for _ in range(g.K)]
-    s1 = polyvecl()
-    y = polyvecl()
-    z = polyvecl()
-    t0 = polyveck()
-    s2 = polyveck()
-    w1 = polyveck()
-    w0 = polyveck()
-    h = polyveck()
-    cp = poly()
-    # state = stream256_state()
-
-    unpack_sk(rho, tr, key, t0, s1, s2, sk)
+def crypto_sign_signature(sig:List[int], siglen:int, m:List[int], mlen:int, sk:List[int], stream:bool=False,
+                          executor=None, attempts:int=4) -> int:
+    pool = None
+    if isinstance(sk, CommitmentPool):
+        if executor is not None:
+            raise ValueError("A commitment pool signs without executor")
+        pool, sk = sk, sk.sk
+    if not isinstance(sk, PreparedSecretKey):
+        sk = PreparedSecretKey(sk, stream)
+    elif sk.settings != _prepared_settings():
+        raise ValueError("The prepared key does not match the current mode and engines")
 
     # Compute CRH(tr, msg)
     state = stream256_state()
-    state.update(bytes(tr))
+    state.update(sk.tr)
     state.update(bytes(m))
     mu = list(state.read(g.CRHBYTES))
 
-    rhoprime = list(shake256(bytes(key+mu), g.CRHBYTES))
-
-    # Expand matrix and transform vectors
-    polyvec_matrix_expand(mat, rho)
-    polyvecl_ntt(s1)
-    polyveck_ntt(s2)
-    polyveck_ntt(t0)
+    rhoprime = list(shake256(sk.key + bytes(mu), g.CRHBYTES))
+    if executor is not None:
+        sign_speculative(sig, sk, mu, rhoprime, executor, attempts)
+        return 0
 
+    scratch = signature_scratch()
+    nonce = 0
     while True:
-        # Sample intermediate vector y
-        polyvecl_uniform_gamma1(y, rhoprime, nonce)
-        nonce += 1
-
-        # Matrix-vector multiplication
-        for i in range(g.L):
-            for j in range(g.N):
-                z.vec[i].coeffs[j] = y.vec[i].coeffs[j]
-        polyvecl_ntt(z)
-        polyvec_matrix_pointwise_montgomery(w1, mat, z)
-        polyveck_reduce(w1)
-        polyveck_invntt_tomont(w1)
-
-        # Decompose w and call the random oracle
-        polyveck_caddq(w1)
-        polyveck_decompose(w1, w0, w1)
-        polyveck_pack_w1(sig, w1)
-
-        state = stream256_state()
-        state.update(bytes(mu))
-        state.update(bytes(sig[:g.K*g.POLYW1_PACKEDBYTES]))
-        temp = list(state.read(g.SEEDBYTES))
-        for i in range(g.SEEDBYTES):
-            sig[i] = temp[i]
-        poly_challenge(cp, sig[:g.SEEDBYTES])
-        poly_ntt(cp)
-
-        # Compute z, reject if it reveals secret
-        polyvecl_pointwise_poly_montgomery(z, cp, s1)
-        polyvecl_invntt_tomont(z)
-        polyvecl_add(z, z, y)
-        polyvecl_reduce(z)
-        if polyvecl_chknorm(z, g.GAMMA1-g.BETA):
-            continue
-
-        # Check that subtracting cs2 does not change high bits of w and low bits
-        # do not reveal secret information
-        polyveck_pointwise_poly_montgomery(h, cp, s2)
-        polyveck_invntt_tomont(h)
-        polyveck_sub(w0, w0, h)
-        polyveck_reduce(w0)
-        if polyveck_chknorm(w0, g.GAMMA2 - g.BETA):
-            continue
-
-        # Compute hints for w1
-        polyveck_pointwise_poly_montgomery(h, cp, t0)
-        polyveck_invntt_tomont(h)
-        polyveck_reduce(h)
-        if polyveck_chknorm(h, g.GAMMA2):
-            continue
-
-        polyveck_add(w0, w0, h)
-        n = polyveck_make_hint(h, w0, w1)
-        if n > g.OMEGA:
-            continue
-
-        # Write signature
-        pack_sig(sig, sig, z, h)
-
-        break
-    return 0
+        if pool is not None:
+            commitment = pool.take()
+        else:
+            commitment = signature_commit(sk, rhoprime, nonce, scratch)
+            nonce += 1
+        if signature_respond(sig, sk, mu, commitment, scratch):
+            return 0
 
 
 #################################################
@@ -195,17 +467,245 @@ def crypto_sign_signature(sig:List[int], siglen:int, m:List[int], mlen:int, sk:L
 #                              message (UNUSED)
 #              - List[int] m:  message to be signed
 #              - int mlen:     length of message (UNUSED)
-#              - List[int] sk: bit-packed secret key
+#              - sk: bit-packed secret key or PreparedSecretKey
+#              - bool stream, executor, int attempts: see
+#                              crypto_sign_signature
 #
 # Returns 0 (success)
 ##################################################
-def crypto_sign(sm:List[int], smlen:int, m:List[int], mlen:int, sk:List[int]) -> int:
+def crypto_sign(sm:List[int], smlen:int, m:List[int], mlen:int, sk:List[int], stream:bool=False,
+                executor=None, attempts:int=4) -> int:
     for i in range(len(m)):
         sm[g.CRYPTO_BYTES + len(m) - 1 -i] = m[len(m) - 1 - i]
-    crypto_sign_signature(sm, smlen, m, mlen, sk)
+    crypto_sign_signature(sm, smlen, m, mlen, sk, stream, executor, attempts)
     return 0
 
 
+# Matrix A in any of its forms as a (K, L, N) tensor for the batch functions
+def _matrix_tensor(mat):
+    if isinstance(mat, np.ndarray):
+        return mat
+    if isinstance(mat, matrix_stream):
+        t = np.zeros((g.K, g.L, g.N), dtype=np.int64)
+        polyvec_matrix_expand(t, mat.rho)
+        return t
+    return np.array([[p.coeffs for p in v.vec] for v in mat], dtype=np.int64)
+
+
+#################################################
+# Name:        crypto_sign_signature_batch
+#
+# Description: Deterministic signatures of many messages under one key,
+#              equal to those of crypto_sign_signature. The rejection loop
+#              runs over a batch axis: y, A*y, the high and low bits, the
+#              products with c and the norm checks of all pending messages
+#              are single array operations, and only hashing and sampling go
+#              message by message. A message leaves the batch when an
+#              attempt is accepted and the next one takes its place. The
+#              products with c are exact FFT products of the coefficients of
+#              s1, s2 and t0, which give the same z and hints whatever
+#              engines are selected. The NTTs run on g.NTT_ENGINE, see
+#              ntt_batch_array. Requires numpy.
+#
+# Arguments:   - sk:       bit-packed secret key or PreparedSecretKey
+#              - messages: list of messages
+#              - int batch: maximal number of messages in flight
+#
+# Returns list of signatures.
+##################################################
+def crypto_sign_signature_batch(sk: List[int], messages: list, batch: int = 64) -> list:
+    if np is None:
+        raise ImportError("Batched signing requires numpy")
+    if batch < 1:
+        raise ValueError("The batch has to hold at least one message")
+    # The products with c do not depend on g.CHALLENGE
+    if isinstance(sk, PreparedSecretKey) and sk.settings[:4] != _prepared_settings(challenge=False):
+        raise ValueError("The prepared key does not match the current mode and engines")
+
+    rho, tr, key = ([0]*g.SEEDBYTES for _ in range(3))
+    s1 = polyvecl()
+    s2 = polyveck()
+    t0 = polyveck()
+    unpack_sk(rho, tr, key, t0, s1, s2, list(sk.packed if isinstance(sk, PreparedSecretKey) else sk))
+    S = polys_to_array(s1.vec + s2.vec + t0.vec)
+    mat = _matrix_tensor(sk.mat if isinstance(sk, PreparedSecretKey) else polyvec_matrix(rho))
+
+    # Compute CRH(tr, msg) and rhoprime for every message
+    mu, rhoprime = [], []
+    for m in messages:
+        state = stream256_state()
+        state.update(bytes(tr))
+        state.update(bytes(m))
+        mu.append(state.read(g.CRHBYTES))
+        rhoprime.append(shake256(bytes(key) + mu[-1], g.CRHBYTES))
+
+    sigs = [None]*len(messages)
+    nonce = [0]*len(messages)
+    waiting = list(range(len(messages)))[::-1]
+    active = []
+    w1bytes = g.K*g.POLYW1_PACKEDBYTES
+    cp = poly()
+    while waiting or active:
+        while waiting and len(active) < batch:
+            active.append(waiting.pop())
+        B = len(active)
+
+        # Sample y as polyvecl_uniform_gamma1
+        buf = []
+        for b in active:
+            for i in range(g.L):
+                state = stream256_state()
+                stream256_init(state, rhoprime[b], g.L*nonce[b] + i)
+                buf.append(state.read(g.POLYZ_PACKEDBYTES))
+        y = polyz_unpack_array(b"".join(buf)).reshape(B, g.L, g.N)
+
+        # Matrix-vector multiplication, high bits of w and their packing
+        yhat = ntt_batch_array(y.reshape(-1, g.N).copy()).reshape(y.shape)
+        w = reduce32_array(matrix_pointwise_array(mat, yhat))
+        w = caddq_array(invntt_tomont_batch_array(w.reshape(-1, g.N)).reshape(w.shape))
+        w1 = highbits_array(w)
+        packed = pack_array(w1.reshape(-1, g.N), *codec_spec("w1"))
+
+        # Call the random oracle
+        c = []
+        C = np.empty((B, g.N), dtype=np.int64)
+        for k, b in enumerate(active):
+            state = stream256_state()
+            state.update(mu[b])
+            state.update(packed[k*w1bytes:(k+1)*w1bytes])
+            c.append(list(state.read(g.SEEDBYTES)))
+            poly_challenge(cp, c[k])
+            C[k] = cp.coeffs
+
+        # Rejection checks, each on the attempts that passed the ones before
+        idx = np.arange(B)
+        z = reduce32_array(fft_mul(C[:, None], S[None, :g.L]) + y)
+        idx = idx[(np.abs(z) < g.GAMMA1 - g.BETA).all(axis=(1, 2))]
+        w0 = reduce32_array(lowbits_array(w[idx], w1[idx]) - fft_mul(C[idx, None], S[None, g.L:g.L+g.K]))
+        passed = (np.abs(w0) < g.GAMMA2 - g.BETA).all(axis=(1, 2))
+        idx, w0 = idx[passed], w0[passed]
+        h = reduce32_array(fft_mul(C[idx, None], S[None, g.L+g.K:]))
+        passed = (np.abs(h) < g.GAMMA2).all(axis=(1, 2))
+        idx, w0, h = idx[passed], w0[passed], h[passed]
+        h = make_hint_array(w0 + h, w1[idx])
+        passed = h.sum(axis=(1, 2)) <= g.OMEGA
+
+        # Write the accepted signatures, try the others again
+        zv = polyvecl()
+        hv = polyveck()
+        for k, hk in zip(idx[passed].tolist(), h[passed]):
+            sig = [0]*g.CRYPTO_BYTES
+            polys_from_array(zv.vec, z[k])
+            polys_from_array(hv.vec, hk)
+            pack_sig(sig, c[k], zv, hv)
+            sigs[active[k]] = sig
+        for b in active:
+            nonce[b] += 1
+        active = [b for b in active if sigs[b] is None]
+
+    return sigs
+
+
+#################################################
+# Name:        CommitmentPool
+#
+# Description: Offline/online signing. A background thread keeps a bounded
+#              pool of commitments (see signature_commit) for a prepared
+#              secret key, each from a fresh random seed. Signing with the
+#              pool in place of the key only runs signature_respond online,
+#              which makes the signatures randomized instead of
+#              deterministic. take() hands out every commitment once and
+#              computes one on the spot when the pool is empty. The thread
+#              shares the GIL with the caller, so it pays off when signing
+#              requests leave idle time between them. Commitments are only
+#              added under the settings of the key.
+#
+# Arguments:   - sk: bit-packed secret key or PreparedSecretKey
+#              - int size: number of commitments kept ready
+##################################################
+class CommitmentPool:
+    __slots__ = ("sk", "commitments", "closed", "worker")
+
+    def __init__(self, sk: List[int], size: int = 16):
+        if not isinstance(sk, PreparedSecretKey):
+            sk = PreparedSecretKey(sk)
+        self.sk = sk
+        self.commitments = queue.Queue(size)
+        self.closed = threading.Event()
+        self.worker = threading.Thread(target=self._fill, daemon=True)
+        self.worker.start()
+
+    def _commit(self) -> tuple:
+        return signature_commit(self.sk, list(urandom(g.CRHBYTES)), 0)
+
+    def _fill(self):
+        while not self.closed.is_set():
+            if self.sk.settings != _prepared_settings():
+                self.closed.wait(0.1)
+                continue
+            commitment = self._commit()
+            if self.sk.settings != _prepared_settings():
+                continue
+            while not self.closed.is_set():
+                try:
+                    self.commitments.put(commitment, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def __len__(self) -> int:
+        return self.commitments.qsize()
+
+    #################################################
+    # Name:        take
+    #
+    # Description: Remove a commitment from the pool, or compute a new one
+    #              if the pool is empty.
+    #
+    # Returns tuple (y, w, w1, packed w1).
+    ##################################################
+    def take(self) -> tuple:
+        try:
+            return self.commitments.get_nowait()
+        except queue.Empty:
+            return self._commit()
+
+    def close(self):
+        self.closed.set()
+        self.worker.join()
+
+
+#################################################
+# Name:        PreparedPublicKey
+#
+# Description: Public key prepared once for verifying many signatures:
+#              tr = H(pk), the expanded matrix A and NTT(t1*2^D). Like
+#              PreparedSecretKey it is only read, can be shared by threads
+#              and is bound to the mode, g.POLYMUL and g.ARITH.
+#
+# Arguments:   - List[int] pk: bit-packed public key
+#              - bool stream:  keep A as a matrix_stream, see
+#                              PreparedSecretKey
+##################################################
+class PreparedPublicKey:
+    __slots__ = ("tr", "mat", "t1", "settings")
+
+    def __init__(self, pk: List[int], stream: bool = False):
+        rho = [0]*g.SEEDBYTES
+        t1 = polyveck()
+        unpack_pk(rho, t1, pk)
+
+        mat = polyvec_matrix(rho, stream)
+        if np is not None and isinstance(mat, np.ndarray):
+            mat.flags.writeable = False
+        polyveck_shiftl(t1)
+        polyveck_ntt(t1)
+
+        self.tr = shake256(bytes(pk), g.SEEDBYTES)
+        self.mat, self.t1 = mat, t1
+        self.settings = _prepared_settings(challenge=False)
+
+
 #################################################
 # Name:        crypto_sign_verify
 #
@@ -215,53 +715,53 @@ def crypto_sign(sm:List[int], smlen:int, m:List[int], mlen:int, sk:List[int]) ->
 #              - int siglen:    length of signature (UNUSED)
 #              - List[int] m:   message
 #              - int mlen:      length of message (UNUSED)
-#              - List[int] pk:  bit-packed public key
+#              - pk:            bit-packed public key or PreparedPublicKey;
+#                               a prepared key skips hashing pk, matrix
+#                               expansion and the transform of t1
+#              - bool stream:   expand A row by row while multiplying
+#                               instead of holding it; a prepared key keeps
+#                               the choice it was prepared with
 #
 # Returns 0 if signature could be verified correctly and -1 otherwise
 ##################################################
-def crypto_sign_verify(sig: List[int], siglen:int, m:List[int], mlen:int, pk:List[int]) -> int:
+def crypto_sign_verify(sig: List[int], siglen:int, m:List[int], mlen:int, pk:List[int], stream:bool=False) -> int:
+    if len(sig) != g.CRYPTO_BYTES:
+        return -1
+
+    if not isinstance(pk, PreparedPublicKey):
+        pk = PreparedPublicKey(pk, stream)
+    elif pk.settings != _prepared_settings(challenge=False):
+        raise ValueError("The prepared key does not match the current mode and engines")
+
     buf = [0]*(g.K*g.POLYW1_PACKEDBYTES)
-    rho = [0]*g.SEEDBYTES
-    # mu = [0]*CRHBYTES
     c = [0]*g.SEEDBYTES
-    # c2 = [0]*SEEDBYTES
     cp = poly()
-    mat = [polyvecl() for _ in range(g.K)]
     z = polyvecl()
-    t1 = polyveck()
     w1 = polyveck()
+    ct1 = polyveck()
     h = polyveck()
-    # state = stream256_state()
-
-    if len(sig) != g.CRYPTO_BYTES:
-        return -1
 
-    unpack_pk(rho, t1, pk)
     if unpack_sig(c, z, h, sig):
         return -1
     if polyvecl_chknorm(z, g.GAMMA1 - g.BETA):
         return -1
 
     # Compute CRH(H(rho, t1), msg)
-    mu = list(shake256(bytes(pk), g.SEEDBYTES))
     state = stream256_state()
-    state.update(bytes(mu))
+    state.update(pk.tr)
     state.update(bytes(m))
     mu = list(state.read(g.CRHBYTES))
 
     # Matrix-vector multiplication; compute Az - c2^dt1
     poly_challenge(cp, c)
-    polyvec_matrix_expand(mat, rho)
 
     polyvecl_ntt(z)
-    polyvec_matrix_pointwise_montgomery(w1, mat, z)
+    polyvec_matrix_pointwise_montgomery(w1, pk.mat, z)
 
     poly_ntt(cp)
-    polyveck_shiftl(t1)
-    polyveck_ntt(t1)
-    polyveck_pointwise_poly_montgomery(t1, cp, t1)
+    polyveck_pointwise_poly_montgomery(ct1, cp, pk.t1)
 
-    polyveck_sub(w1, w1, t1)
+    polyveck_sub(w1, w1, ct1)
     polyveck_reduce(w1)
     polyveck_invntt_tomont(w1)
 
@@ -293,16 +793,17 @@ def crypto_sign_verify(sig: List[int], siglen:int, m:List[int], mlen:int, pk:Lis
 #              - List[int] sm: signed message
 #              - int smlen:    length of signed message (UNUSED)
 #              - List[int] pk: bit-packed public key
+#              - bool stream:  see crypto_sign_verify
 #
 # Returns 0 if signed message could be verified correctly and -1 otherwise
 ##################################################
-def crypto_sign_open(m:List[int], mlen:int, sm:List[int], smlen:int, pk:List[int]) -> int:
+def crypto_sign_open(m:List[int], mlen:int, sm:List[int], smlen:int, pk:List[int], stream:bool=False) -> int:
     while True:
         if len(sm) < g.CRYPTO_BYTES:
             break
 
         mlen = len(sm) - g.CRYPTO_BYTES
-        if crypto_sign_verify(sm[:g.CRYPTO_BYTES], g.CRYPTO_BYTES, sm[g.CRYPTO_BYTES:], mlen, pk):
+        if crypto_sign_verify(sm[:g.CRYPTO_BYTES], g.CRYPTO_BYTES, sm[g.CRYPTO_BYTES:], mlen, pk, stream):
             break
         else:
             for i in range(mlen):
@@ -311,3 +812,94 @@ def crypto_sign_open(m:List[int], mlen:int, sm:List[int], smlen:int, pk:List[int
     for i in range(len(m)):
         m[i] = 0
     return -1
+
+
+#################################################
+# Name:        crypto_sign_verify_batch
+#
+# Description: Verify many signatures against one public key, with the same
+#              result for each as crypto_sign_verify. The public key is
+#              prepared once. The z of all signatures are decoded together,
+#              and NTT(z), A*z, c*t1, the inverse NTT and use_hint run as
+#              array operations over the batch, the transforms on
+#              g.NTT_ENGINE; only the hint decoding, the
+#              challenges and the hashing go signature by signature. A
+#              malformed signature only fails its own entry. Requires numpy.
+#
+# Arguments:   - pk:    bit-packed public key or PreparedPublicKey
+#              - items: list of (message, signature) pairs
+#              - int batch: maximal number of signatures per array operation
+#
+# Returns list with 0 for every valid signature and -1 otherwise.
+##################################################
+def crypto_sign_verify_batch(pk: List[int], items: list, batch: int = 64) -> List[int]:
+    if np is None:
+        raise ImportError("Batched verification requires numpy")
+    if batch < 1:
+        raise ValueError("The batch has to hold at least one signature")
+    if not isinstance(pk, PreparedPublicKey):
+        pk = PreparedPublicKey(pk)
+    elif pk.settings != _prepared_settings(challenge=False):
+        raise ValueError("The prepared key does not match the current mode and engines")
+    mat = _matrix_tensor(pk.mat)
+    t1 = polys_to_array(pk.t1.vec)
+
+    results = [-1]*len(items)
+    zbytes = g.L*g.POLYZ_PACKEDBYTES
+    w1bytes = g.K*g.POLYW1_PACKEDBYTES
+    hv = polyveck()
+    cp = poly()
+    for first in range(0, len(items), batch):
+        # Decode the hints one by one, dropping malformed signatures
+        index, c, h = [], [], []
+        for k in range(first, min(first + batch, len(items))):
+            sig = items[k][1]
+            if len(sig) != g.CRYPTO_BYTES or unpack_hint(hv.vec, sig, g.SEEDBYTES + zbytes):
+                continue
+            index.append(k)
+            c.append(bytes(sig[:g.SEEDBYTES]))
+            h.append(polys_to_array(hv.vec))
+        if not index:
+            continue
+
+        # Decode all z at once and check their norm
+        z = unpack_array(b"".join(bytes(items[k][1][g.SEEDBYTES:g.SEEDBYTES+zbytes]) for k in index),
+                         *codec_spec("z")).reshape(-1, g.L, g.N)
+        passed = (np.abs(z) < g.GAMMA1 - g.BETA).all(axis=(1, 2))
+        index = [k for k, p in zip(index, passed.tolist()) if p]
+        c = [x for x, p in zip(c, passed.tolist()) if p]
+        z, h = z[passed], np.array(h, dtype=np.int64).reshape(-1, g.K, g.N)[passed]
+        if not index:
+            continue
+
+        # Matrix-vector multiplication; compute Az - c2^dt1
+        C = np.empty((len(index), g.N), dtype=np.int64)
+        for i, x in enumerate(c):
+            poly_challenge(cp, x)
+            C[i] = cp.coeffs
+        if g.POLYMUL == "ntt":
+            # One transform of z and the challenges together
+            a = ntt_batch_array(np.concatenate((z.reshape(-1, g.N), C)))
+            z, C = a[:-len(C)].reshape(z.shape), a[-len(C):]
+            ct1 = C[:, None, :]*t1
+            ct1 = ct1 % g.Q if g.ARITH == "plain" else montgomery_reduce_array(ct1)
+        else:
+            ct1 = fft_mul(C[:, None, :], t1)
+        w1 = reduce32_array(matrix_pointwise_array(mat, z) - ct1)
+        w1 = invntt_tomont_batch_array(w1.reshape(-1, g.N)).reshape(w1.shape)
+
+        # Reconstruct w1, call the random oracle and verify the challenges
+        w1 = use_hint_array(caddq_array(w1), h)
+        packed = pack_array(w1.reshape(-1, g.N), *codec_spec("w1"))
+        for i, k in enumerate(index):
+            state = stream256_state()
+            state.update(pk.tr)
+            state.update(bytes(items[k][0]))
+            mu = state.read(g.CRHBYTES)
+            state = stream256_state()
+            state.update(mu)
+            state.update(packed[i*w1bytes:(i+1)*w1bytes])
+            if state.read(g.SEEDBYTES) == c[i]:
+                results[k] = 0
+
+    return results
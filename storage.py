@@ -0,0 +1,67 @@
+# Storage of polynomial coefficients. With g.STORAGE == "list" every
+# polynomial owns a Python list, which is the fastest for the scalar loops of
+# the reference code. With g.STORAGE == "array" the coefficients live in
+# array('q') blocks of machine integers, 8 bytes each, and the polynomials of
+# a polyvec are memoryview rows of one block. This takes a fraction of the
+# memory and allocations of the lists, and numpy reads the rows without
+# converting boxed integers.
+
+from params import *
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+#################################################
+# Name:        zero_coeffs
+#
+# Description: Allocate zero coefficients in the storage of g.STORAGE.
+#
+# Arguments:   - int n: number of coefficients
+#
+# Returns list or array('q') of length n.
+##################################################
+def zero_coeffs(n: int):
+    if g.STORAGE == "array":
+        return array('q', bytes(8*n))
+    if g.STORAGE != "list":
+        raise ValueError(f"Unknown storage {g.STORAGE!r}")
+    return [0]*n
+
+
+#################################################
+# Name:        block_rows
+#
+# Description: Split an array('q') block into rows of N coefficients. The
+#              rows are views, so writing a row writes the block.
+#
+# Arguments:   - array block: block of a multiple of N coefficients
+#
+# Returns list of memoryviews.
+##################################################
+def block_rows(block) -> list:
+    m = memoryview(block)
+    return [m[i:i+g.N] for i in range(0, len(block), g.N)]
+
+
+#################################################
+# Name:        set_coeffs
+#
+# Description: Overwrite coefficients in place, dst[:] = src, for every kind
+#              of storage. Buffers only accept buffers of the same format in
+#              slice assignment, so lists are converted first and numpy
+#              arrays are written through a view.
+#
+# Arguments:   - dst: list, array('q') or memoryview of coefficients
+#              - src: iterable or numpy array of the same length
+##################################################
+def set_coeffs(dst, src):
+    if type(dst) is list:
+        dst[:] = src.tolist() if np is not None and isinstance(src, np.ndarray) else src
+    elif np is not None and isinstance(src, np.ndarray):
+        np.frombuffer(dst, dtype=np.int64)[:] = src
+    else:
+        dst[:] = array('q', src)
@@ -1,4 +1,5 @@
 from sign import *
+import random
 
 
 def test_dilithium2():
@@ -103,7 +104,649 @@ def test_dilithium5():
     print("Dilithium 5 passes all KATs")
 
 
+def check_kats(mode, count):
+    g.set_mode(mode)
+    f = open(f"KATs/KAT_Dilithium{mode}.rsp", "r")
+    f.readline()
+    f.readline()
+    for i in range(count):
+        fields = [f.readline().split()[-1] for _ in range(8)]
+        seed, msg, pk_kat, sk_kat, sig_kat = (bytes.fromhex(fields[j]) for j in (1, 3, 4, 5, 7))
+
+        pk = [0]*g.CRYPTO_PUBLICKEYBYTES
+        sk = [0]*g.CRYPTO_SECRETKEYBYTES
+        crypto_sign_keypair(pk, sk, seed)
+        assert bytes(pk) == pk_kat
+        assert bytes(sk) == sk_kat
+
+        sig = [0]*g.CRYPTO_BYTES
+        crypto_sign_signature(sig, len(sig), list(msg), len(msg), sk)
+        assert bytes(sig) == sig_kat
+
+        assert crypto_sign_verify(sig, len(sig), list(msg), len(msg), pk) == 0
+        f.readline()
+    f.close()
+
+
+def test_ntt_numpy():
+    for _ in range(20):
+        a = [[random.randrange(-g.Q+1, g.Q) for _ in range(g.N)] for _ in range(3)]
+        b = [r.copy() for r in a]
+        g.NTT_ENGINE = "numpy"
+        ntt_batch(a)
+        g.NTT_ENGINE = "reference"
+        ntt_batch(b)
+        assert a == b
+
+        g.NTT_ENGINE = "numpy"
+        invntt_tomont_batch(a)
+        g.NTT_ENGINE = "reference"
+        for r in b:
+            invntt_tomont(r)
+        assert a == b
+
+    g.NTT_ENGINE = "numpy"
+    for mode in [2, 3, 5]:
+        check_kats(mode, 5)
+    g.NTT_ENGINE = "reference"
+    print("numpy NTT engine matches the reference")
+
+
+def test_plain_arith():
+    for _ in range(20):
+        a = [random.randrange(-g.Q+1, g.Q) for _ in range(g.N)]
+        b = ntt_plain(a.copy())
+        assert [x % g.Q for x in b] == [x % g.Q for x in ntt(a.copy())]
+        assert invntt_plain(b) == [x % g.Q for x in a]
+
+    g.ARITH = "plain"
+    for engine in ["reference", "numpy"]:
+        g.NTT_ENGINE = engine
+        for mode in [2, 3, 5]:
+            check_kats(mode, 3)
+    g.NTT_ENGINE = "reference"
+    g.ARITH = "montgomery"
+    print("plain arithmetic matches the KATs")
+
+
+def schoolbook_mul(a, b):
+    c = [0]*(2*g.N)
+    for i in range(g.N):
+        for j in range(g.N):
+            c[i+j] += a[i]*b[j]
+    return [(c[i] - c[i+g.N]) % g.Q for i in range(g.N)]
+
+
+def test_kronecker():
+    for _ in range(5):
+        a = [random.randrange(-g.Q+1, g.Q) for _ in range(g.N)]
+        b = [random.randrange(-g.Q+1, g.Q) for _ in range(g.N)]
+        assert kron_mul(a, b) == schoolbook_mul(a, b)
+
+    g.POLYMUL = "kronecker"
+    for mode in [2, 3, 5]:
+        check_kats(mode, 3)
+    g.POLYMUL = "ntt"
+    print("kronecker multiplication matches the KATs")
+
+
+def test_fft():
+    for _ in range(5):
+        a = [random.randrange(-g.Q+1, g.Q) for _ in range(g.N)]
+        b = [random.randrange(-g.Q+1, g.Q) for _ in range(g.N)]
+        assert fft_mul(a, b).tolist() == schoolbook_mul(a, b)
+
+    g.POLYMUL = "fft"
+    for mode in [2, 3, 5]:
+        check_kats(mode, 3)
+    g.POLYMUL = "ntt"
+    print("fft multiplication matches the KATs")
+
+
+def test_ntt_radix4():
+    for arith in ["montgomery", "plain"]:
+        g.ARITH = arith
+        for _ in range(20):
+            a = [random.randrange(-g.Q+1, g.Q) for _ in range(g.N)]
+            b = a.copy()
+            g.NTT_ENGINE = "radix4"
+            ntt_batch([a])
+            g.NTT_ENGINE = "reference"
+            ntt_batch([b])
+            assert a == b
+
+            a = [random.randrange(-g.Q+1, g.Q) for _ in range(g.N)]
+            b = a.copy()
+            g.NTT_ENGINE = "radix4"
+            invntt_tomont_batch([a])
+            g.NTT_ENGINE = "reference"
+            invntt_tomont_batch([b])
+            assert a == b
+    g.ARITH = "montgomery"
+
+    g.NTT_ENGINE = "radix4"
+    for mode in [2, 3, 5]:
+        check_kats(mode, 3)
+    g.NTT_ENGINE = "reference"
+    print("radix4 NTT engine matches the reference")
+
+
+def test_ntt_blas():
+    a = [[random.randrange(-g.Q+1, g.Q) for _ in range(g.N)] for _ in range(4)]
+    b = [r.copy() for r in a]
+    g.NTT_ENGINE = "blas"
+    g.NTT_BLAS_THRESHOLD = 1
+    ntt_batch(a)
+    assert a == [[x % g.Q for x in ntt(r)] for r in b]
+    for arith in ["montgomery", "plain"]:
+        g.ARITH = arith
+        c = [r.copy() for r in b]
+        d = [r.copy() for r in b]
+        invntt_tomont_batch(c)
+        g.NTT_ENGINE = "reference"
+        invntt_tomont_batch(d)
+        g.NTT_ENGINE = "blas"
+        assert c == [[x % g.Q for x in r] for r in d]
+    g.ARITH = "montgomery"
+
+    for mode in [2, 3, 5]:
+        check_kats(mode, 3)
+
+    # With this seed a standard representative of t1 plus s2 exceeds Q-1
+    g.set_mode(2)
+    keys = []
+    for engine in ["reference", "blas"]:
+        g.NTT_ENGINE = engine
+        pk = [0]*g.CRYPTO_PUBLICKEYBYTES
+        sk = [0]*g.CRYPTO_SECRETKEYBYTES
+        crypto_sign_keypair(pk, sk, (108819).to_bytes(4, 'little')*8)
+        keys.append((pk, sk))
+    assert keys[0] == keys[1]
+    g.NTT_BLAS_THRESHOLD = Parameters.NTT_BLAS_THRESHOLD
+    g.NTT_ENGINE = "reference"
+    print("blas NTT engine matches the KATs")
+
+
+def test_reduce_kernels():
+    import numpy as np
+    a = [random.randrange(-2**31 + 2**22, 2**31 - 2**22) for _ in range(1000)]
+    x = np.array(a, dtype=np.int64)
+    assert reduce32_array(x).tolist() == [reduce32(t) for t in a]
+    assert caddq_array(x).tolist() == [caddq(t) for t in a]
+    assert freeze_array(x).tolist() == [freeze(t) for t in a]
+    b = [random.randrange(-2**31*g.Q, 2**31*g.Q) for _ in range(1000)]
+    assert montgomery_reduce_array(np.array(b, dtype=np.int64)).tolist() == [montgomery_reduce(t) for t in b]
+
+    g.KERNELS = "numpy"
+    for mode in [2, 3, 5]:
+        check_kats(mode, 3)
+    g.KERNELS = "reference"
+    print("numpy reduction kernels match the reference")
+
+
+def test_rounding_kernels():
+    import numpy as np
+    for mode in [2, 3]:
+        g.set_mode(mode)
+        a = [random.randrange(g.Q) for _ in range(1000)] + [0, g.Q-1]
+        x = np.array(a, dtype=np.int64)
+        for f, fa in [(power2round, power2round_array), (decompose, decompose_array)]:
+            r0, r1 = fa(x)
+            assert list(zip(r0.tolist(), r1.tolist())) == [f(t) for t in a]
+        h = [random.randrange(2) for _ in a]
+        assert use_hint_array(x, np.array(h)).tolist() == [use_hint(t, b) for t, b in zip(a, h)]
+        a1 = highbits_array(x)
+        assert a1.tolist() == [highbits(t) for t in a]
+        assert lowbits_array(x, a1).tolist() == [lowbits(t, highbits(t)) for t in a] == [decompose(t)[0] for t in a]
+
+    g.KERNELS = "numpy"
+    for mode in [2, 3, 5]:
+        check_kats(mode, 3)
+    g.KERNELS = "reference"
+    print("numpy rounding kernels match the reference")
+
+
+def test_rounding_tables():
+    import tempfile
+    with tempfile.TemporaryDirectory() as d:
+        g.ROUNDING_TABLE_DIR = d
+        for mode in [2, 3]:
+            g.set_mode(mode)
+            a = [random.randrange(g.Q) for _ in range(1000)] + [0, g.Q-1]
+            h = [random.randrange(2) for _ in a]
+            ref = [(decompose(t), use_hint(t, b)) for t, b in zip(a, h)]
+            g.ROUNDING = "tables"
+            assert [(decompose(t), use_hint(t, b)) for t, b in zip(a, h)] == ref
+            g.ROUNDING = "arith"
+
+        g.ROUNDING = "tables"
+        for mode in [2, 3, 5]:
+            check_kats(mode, 3)
+        g.KERNELS = "numpy"
+        for mode in [2, 3, 5]:
+            check_kats(mode, 3)
+        g.KERNELS = "reference"
+        g.ROUNDING = "arith"
+        g.ROUNDING_TABLE_DIR = None
+    print("rounding tables match the KATs")
+
+
+def test_sampler():
+    for mode in [2, 3, 5]:
+        g.set_mode(mode)
+        for _ in range(50):
+            seed = bytes(random.randrange(256) for _ in range(g.CRHBYTES))
+            nonce = random.randrange(1 << 16)
+            a, b, c, d = poly(), poly(), poly(), poly()
+            y, z = polyvecl(), polyvecl()
+            poly_uniform(a, seed[:g.SEEDBYTES], nonce)
+            poly_uniform_eta(b, seed, nonce)
+            polyvecl_uniform_gamma1(y, seed, nonce >> 3)
+            g.SAMPLER = "numpy"
+            poly_uniform(c, seed[:g.SEEDBYTES], nonce)
+            poly_uniform_eta(d, seed, nonce)
+            polyvecl_uniform_gamma1(z, seed, nonce >> 3)
+            g.SAMPLER = "reference"
+            assert a.coeffs == c.coeffs and b.coeffs == d.coeffs
+            assert [p.coeffs for p in y.vec] == [p.coeffs for p in z.vec]
+
+    g.SAMPLER = "numpy"
+    for mode in [2, 3, 5]:
+        check_kats(mode, 3)
+    g.SAMPLER = "reference"
+    print("numpy samplers match the reference")
+
+
+def test_codec():
+    for mode in [2, 3, 5]:
+        g.set_mode(mode)
+        for kind, pack, unpack, lo, hi in [("eta", polyeta_pack, polyeta_unpack, -g.ETA, g.ETA),
+                                           ("t1", polyt1_pack, polyt1_unpack, 0, 1023),
+                                           ("t0", polyt0_pack, polyt0_unpack, -(1 << (g.D-1)) + 1, 1 << (g.D-1)),
+                                           ("z", polyz_pack, polyz_unpack, -g.GAMMA1 + 1, g.GAMMA1)]:
+            polys = [poly([random.randint(lo, hi) for _ in range(g.N)]) for _ in range(3)]
+            ref = []
+            for p in polys:
+                t = [0]*(g.N*codec_spec(kind)[0]//8)
+                pack(t, p)
+                ref += t
+            for kernels in ["reference", "numpy"]:
+                g.KERNELS = kernels
+                buf = [0]*len(ref)
+                assert pack_polys(buf, 0, polys, kind) == len(ref) and buf == ref
+                out = [poly() for _ in polys]
+                unpack_polys(out, bytes(buf), 0, kind)
+                assert [p.coeffs for p in out] == [p.coeffs for p in polys]
+            g.KERNELS = "reference"
+
+    # A hint index that repeats is rejected
+    g.set_mode(2)
+    c, z, h = [0]*g.SEEDBYTES, polyvecl(), polyveck()
+    sig = [0]*g.CRYPTO_BYTES
+    start = g.CRYPTO_BYTES - g.OMEGA - g.K
+    sig[start:start+2] = [5, 5]
+    sig[start+g.OMEGA:] = [2]*g.K
+    assert unpack_sig(c, z, h, sig) == 1
+    sig[start+1] = 6
+    assert unpack_sig(c, z, h, sig) == 0 and list(h.vec[0].coeffs[5:7]) == [1, 1]
+    print("codec matches the reference packers")
+
+
+def test_array_storage():
+    g.STORAGE = "array"
+    g.set_mode(3)
+    v = polyveck()
+    v.vec[1].coeffs[0] = 5
+    assert v.block[g.N] == 5
+    assert poly([1, 2]).coeffs.tolist() == [1, 2] + [0]*(g.N-2)
+
+    for mode in [2, 3, 5]:
+        check_kats(mode, 3)
+    g.KERNELS = "numpy"
+    for mode in [2, 3, 5]:
+        check_kats(mode, 3)
+    g.KERNELS = "reference"
+    g.STORAGE = "list"
+    print("array storage matches the KATs")
+
+
+def test_matrix_tensor():
+    import numpy as np
+    g.KERNELS = "numpy"
+    g.set_mode(3)
+    mat = polyvec_matrix_new()
+    polyvec_matrix_expand(mat, bytes(g.SEEDBYTES))
+    v = np.array([[[random.randrange(-9*g.Q, 9*g.Q) for _ in range(g.N)] for _ in range(g.L)] for _ in range(3)])
+    r = matrix_pointwise_array(mat, v)
+    assert r.shape == (3, g.K, g.N)
+    for b in range(3):
+        assert (r[b] == matrix_pointwise_array(mat, v[b])).all()
+
+    for polymul, arith in [("ntt", "plain"), ("fft", "montgomery")]:
+        g.POLYMUL, g.ARITH = polymul, arith
+        for mode in [2, 3, 5]:
+            check_kats(mode, 2)
+    g.POLYMUL, g.ARITH = "ntt", "montgomery"
+    g.KERNELS = "reference"
+    print("matrix tensor matches the KATs")
+
+
+def test_sparse_challenge():
+    import numpy as np
+    g.set_mode(5)
+    c = poly()
+    poly_challenge(c, bytes(random.randrange(256) for _ in range(g.SEEDBYTES)))
+    cs = challenge_sparse(c)
+    assert len(cs) == g.TAU
+    a = poly([random.randrange(-(1 << 12), 1 << 12) for _ in range(g.N)])
+    r = poly()
+    poly_challenge_mul(r, cs, a)
+    assert [x % g.Q for x in r.coeffs] == schoolbook_mul(c.coeffs, a.coeffs)
+    assert challenge_mul_array(cs, np.array([a.coeffs]))[0].tolist() == r.coeffs
+
+    g.CHALLENGE = "sparse"
+    for kernels in ["reference", "numpy"]:
+        g.KERNELS = kernels
+        for mode in [2, 3, 5]:
+            check_kats(mode, 3)
+    g.KERNELS = "reference"
+    g.CHALLENGE = "ntt"
+    print("sparse challenge matches the KATs")
+
+
+def test_prepared_key():
+    import threading
+    g.set_mode(3)
+    pk = [0]*g.CRYPTO_PUBLICKEYBYTES
+    sk = [0]*g.CRYPTO_SECRETKEYBYTES
+    crypto_sign_keypair(pk, sk, bytes(g.SEEDBYTES))
+    for challenge in ["ntt", "sparse"]:
+        g.CHALLENGE = challenge
+        psk = PreparedSecretKey(sk)
+        sigs = [None]*4
+
+        def sign(i):
+            sigs[i] = [0]*g.CRYPTO_BYTES
+            crypto_sign_signature(sigs[i], g.CRYPTO_BYTES, [i], 1, psk)
+
+        threads = [threading.Thread(target=sign, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for i in range(4):
+            sig = [0]*g.CRYPTO_BYTES
+            crypto_sign_signature(sig, g.CRYPTO_BYTES, [i], 1, sk)
+            assert sig == sigs[i]
+
+    g.CHALLENGE = "ntt"
+    try:
+        crypto_sign_signature([0]*g.CRYPTO_BYTES, g.CRYPTO_BYTES, [0], 1, psk)
+        assert False
+    except ValueError:
+        pass
+    print("prepared secret key matches the reference")
+
+    ppk = PreparedPublicKey(pk)
+    sig = [0]*g.CRYPTO_BYTES
+    crypto_sign_signature(sig, g.CRYPTO_BYTES, [1], 1, sk)
+    for _ in range(2):
+        assert crypto_sign_verify(sig, g.CRYPTO_BYTES, [1], 1, ppk) == 0
+        assert crypto_sign_verify(sig, g.CRYPTO_BYTES, [2], 1, ppk) == -1
+    # A signature of the wrong length is rejected before the key is unpacked
+    assert crypto_sign_verify(sig[:-1], g.CRYPTO_BYTES - 1, [1], 1, []) == -1
+    m = [0]*(g.CRYPTO_BYTES + 1)
+    assert crypto_sign_open(m, 0, sig + [1], g.CRYPTO_BYTES + 1, ppk) == 0 and m[0] == 1
+    print("prepared public key verifies")
+
+
+def test_matrix_cache():
+    from matcache import MatrixCache
+    g.set_mode(3)
+    size = 8*g.K*g.L*g.N + 24
+    cache = MatrixCache(budget=2*size)
+    try:
+        for kernels in ["reference", "numpy"]:
+            g.KERNELS = kernels
+            ref = polyvec_matrix_new()
+            polyvec_matrix_expand(ref, bytes(g.SEEDBYTES))
+            for _ in range(2):
+                mat = cache.matrix(bytes(g.SEEDBYTES))
+                if kernels == "numpy":
+                    assert (mat == ref).all()
+                else:
+                    assert [[list(p.coeffs) for p in v.vec] for v in mat] == [[list(p.coeffs) for p in v.vec] for v in ref]
+        assert cache.stats() == {"hits": 3, "misses": 1, "evictions": 0}
+        for i in range(1, 4):
+            cache.matrix(bytes([i])*g.SEEDBYTES)
+        assert cache.stats()["evictions"] == 2
+
+        # A slot that was reused for another key after the lookup found it
+        # keeps the time of the other key
+        keys = [k for k, size, _ in cache._slots() if size]
+        other = cache._find(keys[1])
+        used = cache._slots()[other][2]
+        cache._find = lambda key: other
+        assert cache._read(keys[0]) is not None
+        assert cache._slots()[other][2] == used
+        del cache._find
+
+        g.MATRIX_CACHE = cache
+        for kernels in ["reference", "numpy"]:
+            g.KERNELS = kernels
+            check_kats(3, 2)
+    finally:
+        g.MATRIX_CACHE = None
+        g.KERNELS = "reference"
+        cache.unlink()
+        cache.close()
+    try:
+        MatrixCache(slots=0)
+        assert False
+    except ValueError:
+        pass
+    print("matrix cache matches the KATs")
+
+
+def test_matrix_stream():
+    for polymul, kernels in [("ntt", "reference"), ("ntt", "numpy"), ("kronecker", "reference")]:
+        g.POLYMUL, g.KERNELS = polymul, kernels
+        for mode in [2, 3, 5]:
+            g.set_mode(mode)
+            keys = [[0]*g.CRYPTO_PUBLICKEYBYTES, [0]*g.CRYPTO_SECRETKEYBYTES]
+            crypto_sign_keypair(*keys, bytes([mode])*g.SEEDBYTES)
+            pk = [0]*g.CRYPTO_PUBLICKEYBYTES
+            sk = [0]*g.CRYPTO_SECRETKEYBYTES
+            crypto_sign_keypair(pk, sk, bytes([mode])*g.SEEDBYTES, stream=True)
+            assert [pk, sk] == keys
+            sig = [0]*g.CRYPTO_BYTES
+            crypto_sign_signature(sig, g.CRYPTO_BYTES, [mode], 1, sk)
+            sig_stream = [0]*g.CRYPTO_BYTES
+            crypto_sign_signature(sig_stream, g.CRYPTO_BYTES, [mode], 1, sk, stream=True)
+            assert sig_stream == sig
+            assert crypto_sign_verify(sig, g.CRYPTO_BYTES, [mode], 1, pk, stream=True) == 0
+            assert crypto_sign_verify(sig, g.CRYPTO_BYTES, [0], 1, pk, stream=True) == -1
+    g.POLYMUL, g.KERNELS = "ntt", "reference"
+    print("streaming matrix matches the full matrix")
+
+
+def test_commitment_pool():
+    g.set_mode(2)
+    pk = [0]*g.CRYPTO_PUBLICKEYBYTES
+    sk = [0]*g.CRYPTO_SECRETKEYBYTES
+    crypto_sign_keypair(pk, sk, bytes(g.SEEDBYTES))
+    for challenge in ["ntt", "sparse"]:
+        g.CHALLENGE = challenge
+        pool = CommitmentPool(sk, size=4)
+        sigs = []
+        for _ in range(3):
+            sig = [0]*g.CRYPTO_BYTES
+            crypto_sign_signature(sig, g.CRYPTO_BYTES, [1], 1, pool)
+            assert crypto_sign_verify(sig, g.CRYPTO_BYTES, [1], 1, pk) == 0
+            sigs.append(sig)
+        pool.close()
+        assert sigs[0] != sigs[1] != sigs[2]
+        taken = [pool.take() for _ in range(len(pool) + 2)]
+        assert len({id(c[0]) for c in taken}) == len(taken) and len(pool) == 0
+    g.CHALLENGE = "ntt"
+    print("commitment pool signatures verify")
+
+
+def test_speculative_signing():
+    import multiprocessing
+    from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+    from sign import _attempt_keys
+    g.set_mode(3)
+    pk = [0]*g.CRYPTO_PUBLICKEYBYTES
+    sk = [0]*g.CRYPTO_SECRETKEYBYTES
+    crypto_sign_keypair(pk, sk, bytes(g.SEEDBYTES))
+    # Any executor other than a process pool runs in this process and shares
+    # the prepared key
+    class InlineExecutor(Executor):
+        def submit(self, f, *args):
+            future = Future()
+            future.set_result(f(*args))
+            return future
+
+    _attempt_keys.clear()
+    executors = [ThreadPoolExecutor(3), InlineExecutor(), ProcessPoolExecutor(2, multiprocessing.get_context("fork"))]
+    for executor in executors:
+        for i in range(4):
+            sig = [0]*g.CRYPTO_BYTES
+            crypto_sign_signature(sig, g.CRYPTO_BYTES, [i], 1, sk)
+            sig_spec = [0]*g.CRYPTO_BYTES
+            crypto_sign_signature(sig_spec, g.CRYPTO_BYTES, [i], 1, sk, executor=executor, attempts=3)
+            assert sig_spec == sig
+        executor.shutdown()
+    assert not _attempt_keys
+    print("speculative signing matches the sequential signatures")
+
+
+def test_thread_pool():
+    import numpy as np
+    from concurrent.futures import ThreadPoolExecutor
+    g.KERNELS, g.NTT_ENGINE, g.SAMPLER = "numpy", "numpy", "numpy"
+    g.THREAD_POOL, g.THREAD_POOL_WORKERS = ThreadPoolExecutor(4), 4
+    try:
+        a = np.arange(10*g.N).reshape(10, g.N)
+        assert list(map_rows(lambda rows: [len(rows)], a)) == [10]
+        # Split even the rows of one signature
+        g.THREAD_POOL_MIN = g.N
+        assert list(map_rows(lambda rows: [len(rows)], a)) == [3, 3, 2, 2]
+        for challenge, polymul in [("ntt", "ntt"), ("sparse", "fft")]:
+            g.CHALLENGE, g.POLYMUL = challenge, polymul
+            for mode in [2, 3, 5]:
+                check_kats(mode, 2)
+
+        g.CHALLENGE, g.POLYMUL = "ntt", "ntt"
+        pk = [0]*g.CRYPTO_PUBLICKEYBYTES
+        sk = [0]*g.CRYPTO_SECRETKEYBYTES
+        crypto_sign_keypair(pk, sk, bytes(g.SEEDBYTES))
+        messages = [[i] for i in range(8)]
+        sigs = crypto_sign_signature_batch(sk, messages)
+        assert crypto_sign_verify_batch(pk, list(zip(messages, sigs))) == [0]*8
+        g.THREAD_POOL_MIN = Parameters.THREAD_POOL_MIN
+        assert crypto_sign_signature_batch(sk, messages) == sigs
+    finally:
+        g.THREAD_POOL.shutdown()
+        g.THREAD_POOL, g.THREAD_POOL_WORKERS = None, None
+        g.THREAD_POOL_MIN = Parameters.THREAD_POOL_MIN
+        g.KERNELS, g.NTT_ENGINE, g.SAMPLER = "reference", "reference", "reference"
+        g.CHALLENGE, g.POLYMUL = "ntt", "ntt"
+    print("thread pool matches the KATs")
+
+
+def test_signature_batch():
+    g.NTT_BLAS_THRESHOLD = 1
+    try:
+        for kernels, engine in [("reference", "reference"), ("numpy", "numpy"), ("numpy", "blas")]:
+            g.KERNELS, g.NTT_ENGINE = kernels, engine
+            for mode in [2, 3, 5]:
+                g.set_mode(mode)
+                pk = [0]*g.CRYPTO_PUBLICKEYBYTES
+                sk = [0]*g.CRYPTO_SECRETKEYBYTES
+                crypto_sign_keypair(pk, sk, bytes([mode])*g.SEEDBYTES)
+                messages = [[i]*i for i in range(6)]
+                sigs = crypto_sign_signature_batch(sk, messages, batch=4)
+                for m, sig in zip(messages, sigs):
+                    ref = [0]*g.CRYPTO_BYTES
+                    crypto_sign_signature(ref, g.CRYPTO_BYTES, m, len(m), sk)
+                    assert sig == ref
+    finally:
+        g.KERNELS, g.NTT_ENGINE = "reference", "reference"
+        g.NTT_BLAS_THRESHOLD = Parameters.NTT_BLAS_THRESHOLD
+    assert crypto_sign_signature_batch(sk, []) == []
+
+    # A key prepared for other engines or another mode is rejected; the
+    # challenge engine does not matter
+    g.CHALLENGE = "sparse"
+    psk = PreparedSecretKey(sk)
+    g.CHALLENGE = "ntt"
+    assert crypto_sign_signature_batch(psk, messages) == sigs
+    for polymul, mode in [("kronecker", 5), ("ntt", 2)]:
+        g.POLYMUL = polymul
+        g.set_mode(mode)
+        try:
+            crypto_sign_signature_batch(psk, messages)
+            assert False
+        except ValueError:
+            pass
+        finally:
+            g.POLYMUL = "ntt"
+    print("batched signatures match the single ones")
+
+
+def test_verify_batch():
+    g.NTT_BLAS_THRESHOLD = 1
+    try:
+        for kernels, engine in [("reference", "reference"), ("numpy", "numpy"), ("numpy", "blas")]:
+            g.KERNELS, g.NTT_ENGINE = kernels, engine
+            for mode in [2, 3, 5]:
+                g.set_mode(mode)
+                pk = [0]*g.CRYPTO_PUBLICKEYBYTES
+                sk = [0]*g.CRYPTO_SECRETKEYBYTES
+                crypto_sign_keypair(pk, sk, bytes([mode])*g.SEEDBYTES)
+                messages = [[i]*i for i in range(4)]
+                items = list(zip(messages, crypto_sign_signature_batch(sk, messages)))
+                items.append((messages[0] + [0], items[0][1]))
+                for pos in [5, g.SEEDBYTES + 3, g.CRYPTO_BYTES - 1]:
+                    bad = list(items[1][1])
+                    bad[pos] ^= 0x80
+                    items.append((messages[1], bad))
+                items.append((messages[2], items[2][1][:-1]))
+                ref = [crypto_sign_verify(sig, len(sig), m, len(m), pk) for m, sig in items]
+                assert ref == [0]*4 + [-1]*5
+                assert crypto_sign_verify_batch(pk, items, batch=3) == ref
+                assert crypto_sign_verify_batch(PreparedPublicKey(pk), items) == ref
+    finally:
+        g.KERNELS, g.NTT_ENGINE = "reference", "reference"
+        g.NTT_BLAS_THRESHOLD = Parameters.NTT_BLAS_THRESHOLD
+    assert crypto_sign_verify_batch(pk, []) == []
+    print("batched verification matches the single one")
+
 if __name__ == "__main__":
     test_dilithium2()
     test_dilithium3()
     test_dilithium5()
+    test_ntt_numpy()
+    test_ntt_radix4()
+    test_ntt_blas()
+    test_plain_arith()
+    test_reduce_kernels()
+    test_rounding_kernels()
+    test_rounding_tables()
+    test_sampler()
+    test_codec()
+    test_array_storage()
+    test_matrix_tensor()
+    test_sparse_challenge()
+    test_prepared_key()
+    test_matrix_cache()
+    test_matrix_stream()
+    test_commitment_pool()
+    test_speculative_signing()
+    test_thread_pool()
+    test_signature_batch()
+    test_verify_batch()
+    test_kronecker()
+    test_fft()